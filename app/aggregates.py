@@ -0,0 +1,69 @@
+from typing import List
+from sqlalchemy import select, insert, delete, text, Date, Select, Executable
+from sqlalchemy.sql import func
+from models import Purchase, ProductSales, ProductDailySales
+
+# Sales per product, computed either live from purchases or read from the
+# trigger-maintained summary tables (PostgreSQL only). Both variants return
+# the same columns.
+
+SUMMARY_COLUMNS = ("total_quantity", "total_revenue", "purchase_count")
+
+def live_product_sales() -> Select:
+    return (
+        select(
+            Purchase.product_id,
+            func.sum(Purchase.quantity).label("total_quantity"),
+            func.sum(Purchase.quantity * Purchase.price_per_unit).label("total_revenue"),
+            func.count().label("purchase_count"),
+        )
+        .group_by(Purchase.product_id)
+        .order_by(Purchase.product_id)
+    )
+
+# date() rather than CAST(... AS DATE): SQLite turns the cast into a number
+def purchase_day():
+    return func.date(Purchase.delivery_date, type_=Date)
+
+def live_product_daily_sales() -> Select:
+    day = purchase_day()
+    return (
+        select(
+            Purchase.product_id,
+            day.label("day"),
+            func.sum(Purchase.quantity).label("total_quantity"),
+            func.sum(Purchase.quantity * Purchase.price_per_unit).label("total_revenue"),
+            func.count().label("purchase_count"),
+        )
+        .group_by(Purchase.product_id, day)
+        .order_by(Purchase.product_id, day)
+    )
+
+def summary_product_sales() -> Select:
+    return (
+        select(ProductSales.product_id, *[getattr(ProductSales, column) for column in SUMMARY_COLUMNS])
+        .where(ProductSales.purchase_count > 0)
+        .order_by(ProductSales.product_id)
+    )
+
+def summary_product_daily_sales() -> Select:
+    return (
+        select(
+            ProductDailySales.product_id,
+            ProductDailySales.day,
+            *[getattr(ProductDailySales, column) for column in SUMMARY_COLUMNS],
+        )
+        .where(ProductDailySales.purchase_count > 0)
+        .order_by(ProductDailySales.product_id, ProductDailySales.day)
+    )
+
+# Full rebuild of both summary tables. Writes to purchases are blocked for
+# the duration so no trigger delta is lost in between
+def recompute_statements() -> List[Executable]:
+    return [
+        text("LOCK TABLE purchases IN SHARE MODE"),
+        delete(ProductSales),
+        insert(ProductSales).from_select(["product_id", *SUMMARY_COLUMNS], live_product_sales()),
+        delete(ProductDailySales),
+        insert(ProductDailySales).from_select(["product_id", "day", *SUMMARY_COLUMNS], live_product_daily_sales()),
+    ]
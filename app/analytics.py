@@ -0,0 +1,127 @@
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import BigInteger, Date, Select, cast, func, select
+from sqlalchemy.orm import Session
+from models import Purchase, ProductSales, ProductDailySales
+
+# Per-customer and per-product purchase analytics: totals, first/last
+# delivery and per-month buckets, each computed by one aggregate query.
+# Customer figures come from purchases through the covering
+# (customer_id, delivery_date) index, so only that customer's index entries
+# are read. Product figures on PostgreSQL come from the trigger-maintained
+# sales summaries, whose size doesn't grow with the number of purchases;
+# only first/last delivery needs purchases, as two seeks on the
+# (product_id, delivery_date) index. source="live" aggregates purchases
+# directly instead.
+
+SOURCES = ("summary", "live")
+
+def month_of(column, dialect: str):
+    if dialect == "postgresql":
+        return cast(func.date_trunc("month", column), Date)
+    return func.date(column, "start of month", type_=Date)
+
+def range_conditions(column, date_from: Optional[date], date_to: Optional[date], is_day: bool = False) -> List[Any]:
+    conditions = []
+    if date_from is not None:
+        conditions.append(column >= date_from)
+    if date_to is not None:
+        # Timestamps: include the whole last day
+        conditions.append(column <= date_to if is_day else column < date_to + timedelta(days=1))
+    return conditions
+
+def purchase_totals(conditions: List[Any]) -> Select:
+    return select(
+        func.count().label("purchase_count"),
+        func.coalesce(func.sum(Purchase.quantity), 0).label("total_quantity"),
+        func.coalesce(func.sum(Purchase.quantity * Purchase.price_per_unit), 0).label("total_revenue"),
+        func.min(Purchase.delivery_date).label("first_delivery"),
+        func.max(Purchase.delivery_date).label("last_delivery"),
+    ).where(*conditions)
+
+def purchase_months(conditions: List[Any], dialect: str) -> Select:
+    month = month_of(Purchase.delivery_date, dialect)
+    return (
+        select(
+            month.label("month"),
+            func.count().label("purchase_count"),
+            func.sum(Purchase.quantity).label("total_quantity"),
+            func.sum(Purchase.quantity * Purchase.price_per_unit).label("total_revenue"),
+        )
+        .where(*conditions)
+        .group_by(month)
+        .order_by(month)
+    )
+
+def summary_totals(product_id: int, date_from: Optional[date], date_to: Optional[date]) -> Select:
+    if date_from is None and date_to is None:
+        return select(ProductSales.purchase_count, ProductSales.total_quantity, ProductSales.total_revenue).where(
+            ProductSales.product_id == product_id
+        )
+    return select(
+        cast(func.coalesce(func.sum(ProductDailySales.purchase_count), 0), BigInteger).label("purchase_count"),
+        func.coalesce(func.sum(ProductDailySales.total_quantity), 0).label("total_quantity"),
+        func.coalesce(func.sum(ProductDailySales.total_revenue), 0).label("total_revenue"),
+    ).where(
+        ProductDailySales.product_id == product_id,
+        *range_conditions(ProductDailySales.day, date_from, date_to, is_day=True),
+    )
+
+def summary_months(product_id: int, date_from: Optional[date], date_to: Optional[date], dialect: str) -> Select:
+    month = month_of(ProductDailySales.day, dialect)
+    return (
+        select(
+            month.label("month"),
+            cast(func.sum(ProductDailySales.purchase_count), BigInteger).label("purchase_count"),
+            func.sum(ProductDailySales.total_quantity).label("total_quantity"),
+            func.sum(ProductDailySales.total_revenue).label("total_revenue"),
+        )
+        .where(
+            ProductDailySales.product_id == product_id,
+            ProductDailySales.purchase_count > 0,
+            *range_conditions(ProductDailySales.day, date_from, date_to, is_day=True),
+        )
+        .group_by(month)
+        .order_by(month)
+    )
+
+def delivery_bounds(conditions: List[Any]) -> Select:
+    return select(
+        func.min(Purchase.delivery_date).label("first_delivery"),
+        func.max(Purchase.delivery_date).label("last_delivery"),
+    ).where(*conditions)
+
+def build_report(totals: Dict[str, Any], months: List[Dict[str, Any]]) -> Dict[str, Any]:
+    totals["average_price"] = totals["total_revenue"] / totals["total_quantity"] if totals["total_quantity"] else None
+    totals["months"] = months
+    return totals
+
+def customer_purchases(db: Session, customer_id: int, date_from: Optional[date] = None, date_to: Optional[date] = None) -> Dict[str, Any]:
+    dialect = db.get_bind().dialect.name
+    conditions = [Purchase.customer_id == customer_id, *range_conditions(Purchase.delivery_date, date_from, date_to)]
+    totals = dict(db.execute(purchase_totals(conditions)).mappings().one())
+    months = [dict(row) for row in db.execute(purchase_months(conditions, dialect)).mappings()]
+    return build_report({"customer_id": customer_id, **totals}, months)
+
+def product_sales(
+    db: Session,
+    product_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    source: str = "summary",
+) -> Dict[str, Any]:
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source: {source}. Available: {', '.join(SOURCES)}")
+    dialect = db.get_bind().dialect.name
+    conditions = [Purchase.product_id == product_id, *range_conditions(Purchase.delivery_date, date_from, date_to)]
+
+    # The summaries only exist with their triggers on PostgreSQL
+    if source == "live" or dialect != "postgresql":
+        totals = dict(db.execute(purchase_totals(conditions)).mappings().one())
+        months = [dict(row) for row in db.execute(purchase_months(conditions, dialect)).mappings()]
+    else:
+        row = db.execute(summary_totals(product_id, date_from, date_to)).mappings().one_or_none()
+        totals = dict(row) if row else {"purchase_count": 0, "total_quantity": 0, "total_revenue": 0}
+        totals.update(db.execute(delivery_bounds(conditions)).mappings().one())
+        months = [dict(row) for row in db.execute(summary_months(product_id, date_from, date_to, dialect)).mappings()]
+    return build_report({"product_id": product_id, **totals}, months)
@@ -1,10 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
-from pydantic import BaseModel, ConfigDict
-from models import Product, Customer, Purchase
-from session import get_db
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select, tuple_, Select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional, Sequence, Set, Type
+from datetime import date, datetime
+import asyncio
+import base64
+import binascii
+import orjson
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
+from models import Product, Customer, Purchase, ProductDailySales
+from session import get_async_db, AsyncSessionLocal
+from cache import cache_delete, cache_get, cache_set, threaded_deletes
+from statements import LOOKUP_STATEMENTS, INSERT_STATEMENTS
+from aggregates import (
+    live_product_sales, live_product_daily_sales, summary_product_sales, summary_product_daily_sales, recompute_statements,
+    purchase_day,
+)
+from explain import EXPLAIN_ENDPOINT_ENABLED, explain_queries
+from responses import OrjsonResponse, response_columns, rows_as_dicts
+from analytics import SOURCES as ANALYTICS_SOURCES, customer_purchases, product_sales
+from querybudget import query_budget
+from olap import OLAP_ENABLED, DIMENSIONS, METRICS, olap_snapshot
+from changes import CHANGE_ENTITIES, CHANGE_FEED_POLL_SECONDS, read_changes
+from pricing import DEFAULT_QUANTITY_OVER, REPRICE_BATCH_SIZE, reprice_purchases
+from export import EXPORT_FORMATS, STREAM_BATCH_SIZE, purchase_details_statement, aencode_rows
 
 app = FastAPI()
 
@@ -51,162 +73,439 @@ class PurchaseResponse(PurchaseBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class BulkCreateResponse(BaseModel):
+    inserted: int
+    ids: List[int]
+
+class RepriceRequest(BaseModel):
+    new_price: float
+    product_id: Optional[int] = None
+    customer_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    quantity_over: Optional[float] = DEFAULT_QUANTITY_OVER
+    dry_run: bool = False
+    batch_size: Optional[int] = None
+
+class RepriceResponse(BaseModel):
+    matched: int
+    to_update: int
+    updated: int
+    batches: int
+    dry_run: bool
+
+# Keyset pagination: rows are ordered by primary key and a page starts right
+# after the last id of the previous one, so every page costs the same as the
+# first. The id to continue from is sent back in the X-Next-Cursor header and
+# is absent on the last page. skip is still honoured when no cursor is given.
+# statement selects plain columns, the page is encoded without ORM objects
+async def paginate(db: AsyncSession, statement: Select, pk, skip: int, limit: int, after_id: Optional[int]) -> Response:
+    statement = statement.order_by(pk)
+    if after_id is not None:
+        statement = statement.where(pk > after_id)
+    elif skip:
+        statement = statement.offset(skip)
+
+    rows = rows_as_dicts(await db.execute(statement.limit(limit)))
+    headers = {}
+    if rows and len(rows) == limit:
+        headers["X-Next-Cursor"] = str(rows[-1][pk.key])
+    return OrjsonResponse(rows, headers=headers)
+
+# Keyset pagination over a sort column that isn't unique: pages are ordered
+# by (sort column, id) and continue after the last pair of the previous page,
+# which a composite index on the same columns serves as a range scan in
+# either direction. The pair travels as an opaque cursor in X-Next-Cursor.
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([sort_value, row_id])).decode().rstrip("=")
+
+# types is the Python type of each value of the cursor, a cursor with any
+# other shape is rejected before it reaches a query
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    try:
+        value = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        value = None
+    # type() rather than isinstance(), which takes true for an int
+    if (
+        not isinstance(value, list)
+        or len(value) != len(types)
+        or any(type(item) is not kind for item, kind in zip(value, types))
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return value
+
+async def sorted_page(db: AsyncSession, statement: Select, sort_column, pk, limit: int, cursor: Optional[str], descending: bool) -> Response:
+    # Sorting by the id itself needs no tie-breaker
+    keys = [pk] if sort_column is pk else [sort_column, pk]
+    if cursor is not None:
+        sort_value, last_id = decode_cursor(cursor, (sort_column.type.python_type, pk.type.python_type))
+        if sort_column is pk:
+            position, after = pk, last_id
+        else:
+            position, after = tuple_(sort_column, pk), tuple_(sort_value, last_id)
+        statement = statement.where(position < after if descending else position > after)
+    statement = statement.order_by(*(key.desc() if descending else key for key in keys))
+
+    rows = rows_as_dicts(await db.execute(statement.limit(limit)))
+    headers = {}
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last[sort_column.key], last[pk.key])
+    return OrjsonResponse(rows, headers=headers)
+
+# Entity lookups go through the shared entity cache, returns a dict of
+# column values or None
+async def get_cached(db: AsyncSession, model, entity: str, entity_id: int) -> Optional[Dict[str, Any]]:
+    key = (entity, entity_id)
+    row = await cache_get(key)
+    if row is None:
+        row = (await db.execute(LOOKUP_STATEMENTS[model], {"entity_id": entity_id})).mappings().first()
+        if row is None:
+            return None
+        row = dict(row)
+        await cache_set(key, row)
+    return row
+
+def check_date_range(date_from: Optional[date], date_to: Optional[date]):
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to.")
+
 # Product endpoints
+# query_budget is the number of statements an endpoint may run when
+# QUERY_BUDGET_MODE is set, None for endpoints that work in batches
 @app.post("/products/", response_model=ProductResponse)
-def create_product(product: ProductCreate, db: Session = Depends(get_db)):
-    db_product = Product(**product.model_dump())
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+@query_budget(1)
+async def create_product(product: ProductCreate, db: AsyncSession = Depends(get_async_db)):
+    db_product = dict((await db.execute(INSERT_STATEMENTS[Product], product.model_dump())).mappings().one())
+    await db.commit()
+    await cache_set(("product", db_product["product_id"]), db_product)
     return db_product
 
 @app.get("/products/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.product_id == product_id).first()
+@query_budget(1)
+async def get_product(product_id: int, db: AsyncSession = Depends(get_async_db)):
+    product = await get_cached(db, Product, "product", product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
 @app.get("/products/", response_model=List[ProductResponse])
-def list_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = db.query(Product).offset(skip).limit(limit).all()
-    return products
+@query_budget(1)
+async def list_products(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    statement = select(*response_columns(Product, ProductResponse))
+    return await paginate(db, statement, Product.product_id, skip, limit, after_id)
 
 # Customer endpoints
 @app.post("/customers/", response_model=CustomerResponse)
-def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)):
-    db_customer = Customer(**customer.model_dump())
-    db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
+@query_budget(1)
+async def create_customer(customer: CustomerCreate, db: AsyncSession = Depends(get_async_db)):
+    db_customer = dict((await db.execute(INSERT_STATEMENTS[Customer], customer.model_dump())).mappings().one())
+    await db.commit()
+    await cache_set(("customer", db_customer["customer_id"]), db_customer)
     return db_customer
 
 @app.get("/customers/{customer_id}", response_model=CustomerResponse)
-def get_customer(customer_id: int, db: Session = Depends(get_db)):
-    customer = db.query(Customer).filter(Customer.customer_id == customer_id).first()
+@query_budget(1)
+async def get_customer(customer_id: int, db: AsyncSession = Depends(get_async_db)):
+    customer = await get_cached(db, Customer, "customer", customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     return customer
 
 @app.get("/customers/", response_model=List[CustomerResponse])
-def list_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    customers = db.query(Customer).offset(skip).limit(limit).all()
-    return customers
+@query_budget(1)
+async def list_customers(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    statement = select(*response_columns(Customer, CustomerResponse))
+    return await paginate(db, statement, Customer.customer_id, skip, limit, after_id)
 
 # Purchase endpoints
 @app.post("/purchases/", response_model=PurchaseResponse)
-def create_purchase(purchase: PurchaseCreate, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.product_id == purchase.product_id).first()
-    customer = db.query(Customer).filter(Customer.customer_id == purchase.customer_id).first()
+@query_budget(3)
+async def create_purchase(purchase: PurchaseCreate, db: AsyncSession = Depends(get_async_db)):
+    product = await get_cached(db, Product, "product", purchase.product_id)
+    customer = await get_cached(db, Customer, "customer", purchase.customer_id)
 
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
 
-    db_purchase = Purchase(**purchase.model_dump())
-    db.add(db_purchase)
-    db.commit()
-    db.refresh(db_purchase)
+    try:
+        db_purchase = dict((await db.execute(INSERT_STATEMENTS[Purchase], purchase.model_dump())).mappings().one())
+        await db.commit()
+    except IntegrityError:
+        # The cached product or customer was deleted by another process
+        # within CACHE_TTL; drop both entries so the next request sees it
+        await db.rollback()
+        await cache_delete(("product", purchase.product_id), ("customer", purchase.customer_id))
+        raise HTTPException(status_code=404, detail="Product or customer not found")
+    await cache_set(("purchase", db_purchase["purchase_id"]), db_purchase)
     return db_purchase
 
 @app.get("/purchases/{purchase_id}", response_model=PurchaseResponse)
-def get_purchase(purchase_id: int, db: Session = Depends(get_db)):
-    purchase = db.query(Purchase).filter(Purchase.purchase_id == purchase_id).first()
+@query_budget(1)
+async def get_purchase(purchase_id: int, db: AsyncSession = Depends(get_async_db)):
+    purchase = await get_cached(db, Purchase, "purchase", purchase_id)
     if not purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return purchase
 
 @app.get("/purchases/", response_model=List[PurchaseResponse])
-def list_purchases(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    purchases = db.query(Purchase).offset(skip).limit(limit).all()
-    return purchases
+@query_budget(1)
+async def list_purchases(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    delivered_from: Optional[datetime] = None,
+    delivered_before: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    statement = select(*response_columns(Purchase, PurchaseResponse))
+    if delivered_from is not None:
+        statement = statement.where(Purchase.delivery_date >= delivered_from)
+    if delivered_before is not None:
+        statement = statement.where(Purchase.delivery_date < delivered_before)
+    return await paginate(db, statement, Purchase.purchase_id, skip, limit, after_id)
+
+
+# Bulk create endpoints
+# The body is a JSON array, or one JSON object per line when sent as
+# application/x-ndjson. All rows are inserted in a single transaction with
+# multi-row INSERT ... RETURNING, BULK_BATCH_SIZE rows per statement
+
+BULK_BATCH_SIZE = 5000
+
+async def read_bulk_body(request: Request, model: Type[BaseModel]) -> List[Dict[str, Any]]:
+    body = await request.body()
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            items = [model.model_validate_json(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = TypeAdapter(List[model]).validate_json(body)
+    except ValidationError as err:
+        # The input of a malformed body is raw bytes, which can't be encoded
+        raise RequestValidationError(err.errors(include_url=False, include_input=False))
+    return [item.model_dump() for item in items]
+
+async def bulk_insert(db: AsyncSession, model, pk, rows: List[Dict[str, Any]]) -> List[int]:
+    statement = insert(model).returning(pk, sort_by_parameter_order=True)
+    ids = []
+    try:
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            result = await db.execute(statement, rows[start:start + BULK_BATCH_SIZE])
+            ids.extend(result.scalars().all())
+        await db.commit()
+    except IntegrityError as err:
+        # e.g. a referenced row deleted after the existence checks
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"Bulk insert rejected: {str(err.orig).splitlines()[0]}")
+    return ids
+
+async def find_missing_ids(db: AsyncSession, pk, ids: Set[int]) -> Set[int]:
+    found = await db.scalars(select(pk).where(pk.in_(ids)))
+    return ids - set(found)
+
+@app.post("/products/bulk", response_model=BulkCreateResponse)
+@query_budget(None)
+async def create_products_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    rows = await read_bulk_body(request, ProductCreate)
+    ids = await bulk_insert(db, Product, Product.product_id, rows)
+    return {"inserted": len(ids), "ids": ids}
+
+@app.post("/customers/bulk", response_model=BulkCreateResponse)
+@query_budget(None)
+async def create_customers_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    rows = await read_bulk_body(request, CustomerCreate)
+    ids = await bulk_insert(db, Customer, Customer.customer_id, rows)
+    return {"inserted": len(ids), "ids": ids}
+
+@app.post("/purchases/bulk", response_model=BulkCreateResponse)
+@query_budget(None)
+async def create_purchases_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    rows = await read_bulk_body(request, PurchaseCreate)
+
+    # One existence check per referenced table and batch instead of two
+    # lookups per purchase
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        batch = rows[start:start + BULK_BATCH_SIZE]
+        missing_products = await find_missing_ids(db, Product.product_id, {row["product_id"] for row in batch})
+        if missing_products:
+            raise HTTPException(status_code=404, detail=f"Products not found: {sorted(missing_products)}")
+        missing_customers = await find_missing_ids(db, Customer.customer_id, {row["customer_id"] for row in batch})
+        if missing_customers:
+            raise HTTPException(status_code=404, detail=f"Customers not found: {sorted(missing_customers)}")
+
+    ids = await bulk_insert(db, Purchase, Purchase.purchase_id, rows)
+    return {"inserted": len(ids), "ids": ids}
 
 
 # SELECT with Multiple Conditions (WHERE)
 
-@app.get("/products/filter/")
-def filter_products(
+@app.get("/products/filter/", response_model=List[ProductResponse])
+@query_budget(1)
+async def filter_products(
     manufacturer: str, 
     unit: str, 
-    db: Session = Depends(get_db)
+    sort_by: str = "product_id",
+    desc: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    products = db.query(Product).filter(
+    valid_sort_fields = {
+        "product_id": Product.product_id,
+        "name": Product.name
+    }
+
+    if sort_by not in valid_sort_fields:
+        raise HTTPException(status_code=400, detail="Invalid sort field")
+
+    statement = select(*response_columns(Product, ProductResponse)).where(
         Product.manufacturer == manufacturer,
         Product.unit == unit
-    ).all()
-    return products
+    )
+    return await sorted_page(db, statement, valid_sort_fields[sort_by], Product.product_id, limit, cursor, desc)
 
 # JOIN Query
 
 @app.get("/purchases/details/")
-def get_purchase_details(db: Session = Depends(get_db)):
-    purchases = (
-        db.query(Purchase, Product, Customer)
-        .join(Product, Purchase.product_id == Product.product_id)
-        .join(Customer, Purchase.customer_id == Customer.customer_id)
-        .all()
-    )
-
-    result = [
-        {
-            "purchase_id": purchase.Purchase.purchase_id,
-            "product_name": purchase.Product.name,
-            "customer_name": purchase.Customer.name,
-            "quantity": purchase.Purchase.quantity,
-            "delivery_date": purchase.Purchase.delivery_date,
-            "price_per_unit": purchase.Purchase.price_per_unit
-        }
-        for purchase in purchases
-    ]
-
-    return result
+async def get_purchase_details(format: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    # format=ndjson or format=csv streams the join instead of building it in memory
+    if format is not None:
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail="Invalid export format")
+        return StreamingResponse(stream_purchase_details(format), media_type=EXPORT_FORMATS[format])
+
+    result = await db.execute(purchase_details_statement())
+    return OrjsonResponse(rows_as_dicts(result))
+
+async def stream_purchase_details(export_format: str):
+    # The request-scoped session may be closed before the body is sent,
+    # so the stream owns its session for as long as it runs
+    async with AsyncSessionLocal() as db:
+        statement = purchase_details_statement().execution_options(yield_per=STREAM_BATCH_SIZE)
+        result = await db.stream(statement)
+        async for line in aencode_rows(result.mappings(), export_format):
+            yield line
 
 # UPDATE with Non-Trivial Condition
 
-@app.put("/purchases/update-price/{purchase_id}")
-def update_price(purchase_id: int, new_price: float, db: Session = Depends(get_db)):
-    purchase = db.query(Purchase).filter(Purchase.purchase_id == purchase_id).first()
-
-    if not purchase:
-        raise HTTPException(status_code=404, detail="Purchase not found")
+# Set-based repricing: one UPDATE ... RETURNING for every purchase matching
+# the filters (or one per batch_size ids), dry_run only counts. The work runs
+# on the sync session underneath so the CLI shares the same code
+@app.post("/purchases/reprice", response_model=RepriceResponse)
+@query_budget(None)
+async def reprice(request: RepriceRequest, db: AsyncSession = Depends(get_async_db)):
+    if request.new_price < 0:
+        raise HTTPException(status_code=400, detail="Price must not be negative.")
+    check_date_range(request.date_from, request.date_to)
+    options = request.model_dump()
+    if options["batch_size"] is None:
+        options["batch_size"] = REPRICE_BATCH_SIZE
+    async with threaded_deletes() as invalidate:
+        return await db.run_sync(lambda session: reprice_purchases(session, **options, invalidate=invalidate))
 
-    if purchase.quantity > 10:  # Non-trivial condition
-        purchase.price_per_unit = new_price
-        db.commit()
-        db.refresh(purchase)
+@app.put("/purchases/update-price/{purchase_id}")
+@query_budget(3)
+async def update_price(purchase_id: int, new_price: float, db: AsyncSession = Depends(get_async_db)):
+    if new_price < 0:
+        raise HTTPException(status_code=400, detail="Price must not be negative.")
+    async with threaded_deletes() as invalidate:
+        result = await db.run_sync(
+            lambda session: reprice_purchases(session, new_price, purchase_id=purchase_id, batch_size=0, invalidate=invalidate)
+        )
+    if result["matched"]:
         return {"message": "Price updated successfully", "purchase_id": purchase_id}
 
+    # Nothing matched: tell a missing purchase apart from a low quantity
+    if await db.scalar(select(Purchase.purchase_id).where(Purchase.purchase_id == purchase_id)) is None:
+        raise HTTPException(status_code=404, detail="Purchase not found")
     return {"message": "Price not updated. Quantity is too low."}
 
 # GROUP BY Query
+# Served from the trigger-maintained summary tables on PostgreSQL, so the
+# cost depends on the number of products, not purchases. recompute=true
+# rebuilds the summaries from purchases first
 
-from sqlalchemy.sql import func
+# source=olap answers from the in-memory snapshot instead, see olap.py
 
-@app.get("/purchases/group-by-product/")
-def group_purchases_by_product(db: Session = Depends(get_db)):
-    grouped_purchases = (
-        db.query(Purchase.product_id, func.sum(Purchase.quantity).label("total_quantity"))
-        .group_by(Purchase.product_id)
-        .all()
-    )
+SALES_SOURCES = (*ANALYTICS_SOURCES, "olap")
+
+def check_sales_source(source: str):
+    if source not in SALES_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
 
-    result = [
-        {
-            "product_id": product_id,
-            "total_quantity": total_quantity
-        }
-        for product_id, total_quantity in grouped_purchases
-    ]
+# Snapshot queries are NumPy passes, run off the event loop
+async def olap_response(query, *args, **kwargs):
+    if not OLAP_ENABLED:
+        raise HTTPException(status_code=400, detail="source=olap needs OLAP_ENABLED=true.")
+    if not olap_snapshot.ready:
+        raise HTTPException(status_code=503, detail="The OLAP snapshot is still loading.")
+    return OrjsonResponse(await asyncio.to_thread(query, *args, **kwargs))
 
-    return result
+async def read_sales_summary(db: AsyncSession, summary: Select, live: Select, recompute: bool, source: str = "summary"):
+    if source == "live" or db.get_bind().dialect.name != "postgresql":
+        return OrjsonResponse(rows_as_dicts(await db.execute(live)))
+
+    if recompute:
+        for statement in recompute_statements():
+            await db.execute(statement)
+        await db.commit()
+    return OrjsonResponse(rows_as_dicts(await db.execute(summary)))
+
+@app.get("/purchases/group-by-product/")
+async def group_purchases_by_product(recompute: bool = False, source: str = "summary", db: AsyncSession = Depends(get_async_db)):
+    check_sales_source(source)
+    if source == "olap":
+        return await olap_response(olap_snapshot.product_sales)
+    return await read_sales_summary(db, summary_product_sales(), live_product_sales(), recompute, source)
+
+@app.get("/purchases/group-by-product/daily/")
+async def group_purchases_by_product_and_day(
+    product_id: Optional[int] = None,
+    day_from: Optional[date] = None,
+    day_to: Optional[date] = None,
+    recompute: bool = False,
+    source: str = "summary",
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_sales_source(source)
+    if source == "olap":
+        return await olap_response(olap_snapshot.product_sales, product_id, day_from, day_to, daily=True)
+    summary, live = summary_product_daily_sales(), live_product_daily_sales()
+    summary_day, live_day = ProductDailySales.day, purchase_day()
+    if product_id is not None:
+        summary = summary.where(ProductDailySales.product_id == product_id)
+        live = live.where(Purchase.product_id == product_id)
+    if day_from is not None:
+        summary = summary.where(summary_day >= day_from)
+        live = live.where(live_day >= day_from)
+    if day_to is not None:
+        summary = summary.where(summary_day <= day_to)
+        live = live.where(live_day <= day_to)
+    return await read_sales_summary(db, summary, live, recompute, source)
 
 # Sorting Query Results
 
-@app.get("/customers/sorted/")
-def get_sorted_customers(
+@app.get("/customers/sorted/", response_model=List[CustomerResponse])
+@query_budget(1)
+async def get_sorted_customers(
     sort_by: str = "name", 
-    db: Session = Depends(get_db)
+    desc: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     valid_sort_fields = {
         "name": Customer.name,
@@ -217,5 +516,157 @@ def get_sorted_customers(
     if sort_by not in valid_sort_fields:
         raise HTTPException(status_code=400, detail="Invalid sort field")
 
-    customers = db.query(Customer).order_by(valid_sort_fields[sort_by]).all()
-    return customers
+    statement = select(*response_columns(Customer, CustomerResponse))
+    return await sorted_page(db, statement, valid_sort_fields[sort_by], Customer.customer_id, limit, cursor, desc)
+
+# Change feed
+# Inserts, updates and deletes of an entity after a position token, see
+# changes.py. The token of the last change comes back as "cursor" and in
+# X-Next-Cursor; without a cursor the feed starts at the beginning.
+# wait=N long-polls up to N seconds for the first change, /stream sends the
+# changes as Server-Sent Events with the token as event id. Polls don't hold
+# a connection while they sleep
+
+# Keep-alive comment for idle streams, proxies close silent connections
+CHANGE_STREAM_KEEPALIVE_SECONDS = 15
+
+def check_change_feed(entity: str, db: AsyncSession):
+    if entity not in CHANGE_ENTITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown entity, available: {', '.join(CHANGE_ENTITIES)}")
+    if db.get_bind().dialect.name != "postgresql":
+        raise HTTPException(status_code=501, detail="The change feed needs PostgreSQL.")
+
+def decode_position(cursor: Optional[str]) -> Optional[List[int]]:
+    if cursor is None:
+        return None
+    return decode_cursor(cursor, (int, int))
+
+@app.get("/changes/{entity}")
+@query_budget(None)
+async def get_changes(
+    entity: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    wait: float = Query(0, ge=0, le=60),
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_change_feed(entity, db)
+    position = decode_position(cursor)
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        changes = await db.run_sync(read_changes, entity, position, limit)
+        # Ends the read transaction and hands the connection back
+        await db.commit()
+        if changes or asyncio.get_running_loop().time() >= deadline:
+            break
+        await asyncio.sleep(CHANGE_FEED_POLL_SECONDS)
+
+    if changes:
+        cursor = encode_cursor(*changes[-1][0])
+    headers = {"X-Next-Cursor": cursor} if cursor else {}
+    return OrjsonResponse({"changes": [change for _, change in changes], "cursor": cursor}, headers=headers)
+
+@app.get("/changes/{entity}/stream")
+@query_budget(None)
+async def stream_changes(
+    entity: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_change_feed(entity, db)
+    # A reconnecting EventSource resumes from the last event it received
+    position = decode_position(request.headers.get("last-event-id") or cursor)
+    return StreamingResponse(
+        change_events(request, entity, position, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+async def change_events(request: Request, entity: str, position: Optional[List[int]], limit: int):
+    idle = 0.0
+    while not await request.is_disconnected():
+        async with AsyncSessionLocal() as db:
+            changes = await db.run_sync(read_changes, entity, position, limit)
+        for position, change in changes:
+            yield f"id: {encode_cursor(*position)}\nevent: {change['op']}\ndata: {orjson.dumps(change).decode()}\n\n"
+        if len(changes) == limit:
+            continue
+
+        await asyncio.sleep(CHANGE_FEED_POLL_SECONDS)
+        idle = 0.0 if changes else idle + CHANGE_FEED_POLL_SECONDS
+        if idle >= CHANGE_STREAM_KEEPALIVE_SECONDS:
+            idle = 0.0
+            yield ": keep-alive\n\n"
+
+# Analytics
+# One aggregate query for the totals and one for the monthly buckets, see
+# analytics.py. date_to is inclusive
+
+@app.get("/analytics/customer-purchases/{customer_id}")
+@query_budget(3)
+async def get_customer_purchases(
+    customer_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    source: str = "live",
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_date_range(date_from, date_to)
+    if source not in ("live", "olap"):
+        raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
+    if not await get_cached(db, Customer, "customer", customer_id):
+        raise HTTPException(status_code=404, detail="Customer not found")
+    if source == "olap":
+        return await olap_response(olap_snapshot.report, date_from, date_to, customer_id=customer_id)
+    return OrjsonResponse(await db.run_sync(customer_purchases, customer_id, date_from, date_to))
+
+@app.get("/analytics/product-sales/{product_id}")
+@query_budget(4)
+async def get_product_sales(
+    product_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    source: str = "summary",
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_date_range(date_from, date_to)
+    check_sales_source(source)
+    if not await get_cached(db, Product, "product", product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    if source == "olap":
+        return await olap_response(olap_snapshot.report, date_from, date_to, product_id=product_id)
+    return OrjsonResponse(await db.run_sync(product_sales, product_id, date_from, date_to, source))
+
+# Top products, customers, manufacturers or units by revenue, quantity or
+# number of purchases. Only served from the OLAP snapshot
+@app.get("/analytics/top/{dimension}")
+async def get_top(
+    dimension: str,
+    metric: str = "total_revenue",
+    limit: int = Query(10, ge=1, le=1000),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    manufacturer: Optional[str] = None,
+    unit: Optional[str] = None,
+):
+    check_date_range(date_from, date_to)
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown dimension: {dimension}")
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric}")
+    return await olap_response(olap_snapshot.top, dimension, metric, limit, date_from, date_to, manufacturer, unit)
+
+# Query plans
+
+@app.get("/debug/explain/")
+async def explain_builtin_queries(name: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    # Runs EXPLAIN (ANALYZE, BUFFERS) for the built-in queries and flags
+    # sequential scans on large tables. Off unless EXPLAIN_ENDPOINT_ENABLED
+    if not EXPLAIN_ENDPOINT_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        return await db.run_sync(explain_queries, name)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
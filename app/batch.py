@@ -0,0 +1,226 @@
+import asyncio
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from session import env_int, engine, SessionLocal, POOL_SIZE
+from cache import entity_cache
+from querybudget import track_queries, budget_of
+from metrics import compiled_cache_stats
+from data import parse_command, invoke
+
+# Batch mode of the command line interface, for scripts of commands read
+# from a file or piped into stdin.
+# The whole script is parsed up front and run in one process and event loop.
+# Consecutive writes (create/update/delete) share one connection and one
+# transaction of up to CLI_TRANSACTION_SIZE commands. The commit inside each
+# command only releases a savepoint, so a failing command is rolled back on
+# its own without losing the rest of the group. Consecutive reads run
+# concurrently on pooled sessions once the pending writes are committed,
+# and their output is printed in script order. Bulk jobs (generate,
+# delete-all, purge-before, reprice) manage their own transactions and run
+# alone between the two.
+
+CLI_TRANSACTION_SIZE = env_int("CLI_TRANSACTION_SIZE", 500)
+CLI_READ_CONCURRENCY = env_int("CLI_READ_CONCURRENCY", POOL_SIZE)
+
+WRITE_ACTIONS = {"create", "update", "delete"}
+READ_ACTIONS = {"get", "get-all", "details"}
+
+def command_kind(parsed: Dict[str, Any]) -> str:
+    entity, action = parsed["entity"], parsed["action"]
+    if action in WRITE_ACTIONS:
+        return "write"
+    # query 3 is the repricing job, exports only read the database
+    if action in READ_ACTIONS or entity in ("explain", "export") or (entity == "query" and action != "3"):
+        return "read"
+    return "job"
+
+# Command output, one line per item. Lists and streamed results are yielded
+# as they arrive
+def result_lines(result: Any) -> Iterator[Any]:
+    if isinstance(result, str):
+        yield result
+    elif result is not None:
+        printed = False
+        for item in result:
+            yield item
+            printed = True
+        if not printed:
+            yield "No result found."
+    else:
+        yield "No result found."
+
+def read_script(lines: Iterable[str]) -> List[Tuple[int, str]]:
+    commands = []
+    for number, line in enumerate(lines, 1):
+        command = line.strip()
+        if command == "exit":
+            break
+        # Blank lines and comments
+        if command and not command.startswith("#"):
+            commands.append((number, command))
+    return commands
+
+class BatchSummary:
+    def __init__(self):
+        self.commands = 0
+        self.reads = 0
+        self.writes = 0
+        self.jobs = 0
+        self.errors = 0
+        self.transactions = 0
+        self.started = time.perf_counter()
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.commands / elapsed if elapsed else 0.0
+        hit_rate = compiled_cache_stats()["sync"]["hit_rate"]
+        return (
+            f"{self.commands} commands ({self.reads} reads, {self.writes} writes, {self.jobs} jobs) "
+            f"in {elapsed:.2f}s, {rate:.1f} commands/s, {self.transactions} write transactions, "
+            f"{self.errors} errors"
+            + (f", compiled cache hit rate {hit_rate:.0%}" if hit_rate is not None else "")
+        )
+
+# Writes go through one session on one connection. The connection holds the
+# group transaction and the session joins it with a savepoint per command
+class WriteGroup:
+    def __init__(self, size: int, summary: BatchSummary):
+        self.size = max(size, 1)
+        self.summary = summary
+        self.connection = None
+        self.db: Optional[Session] = None
+        self.pending = 0
+
+    def session(self) -> Session:
+        if self.connection is None:
+            self.connection = engine.connect()
+            self.db = Session(bind=self.connection, autoflush=False, join_transaction_mode="create_savepoint")
+        if not self.connection.in_transaction():
+            self.connection.begin()
+        return self.db
+
+    def done(self):
+        self.pending += 1
+        if self.pending >= self.size:
+            self.commit()
+
+    def commit(self):
+        if self.connection is None or not self.connection.in_transaction():
+            return
+        pending, self.pending = self.pending, 0
+        # Ends the savepoint a command may have left open by reading after
+        # its commit, and clears the identity map
+        self.db.close()
+        try:
+            self.connection.commit()
+            self.summary.transactions += 1
+        except Exception as e:
+            self.connection.rollback()
+            # Created rows were cached before the group was committed
+            entity_cache.clear()
+            self.summary.errors += pending
+            print(f"Error committing {pending} commands: {str(e)}")
+
+    def close(self):
+        self.commit()
+        if self.connection is not None:
+            self.db.close()
+            self.connection.close()
+
+def run_read(parsed: Dict[str, Any], command: str) -> Tuple[List[str], bool]:
+    with SessionLocal() as db, track_queries(command, budget_of(parsed["method"])):
+        try:
+            result = parsed["method"](*parsed["args"], db)
+            # Consumed here, on the worker thread that owns the session
+            return [str(line) for line in result_lines(result)], False
+        except Exception as e:
+            db.rollback()
+            return [f"Error executing command: {str(e)}"], True
+
+async def run_reads(reads: List[Tuple[int, str, Dict[str, Any]]], concurrency: int, summary: BatchSummary):
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def limited(parsed, command):
+        async with semaphore:
+            return await asyncio.to_thread(run_read, parsed, command)
+
+    tasks = [asyncio.create_task(limited(parsed, command)) for _, command, parsed in reads]
+    # Printed in script order as soon as the earlier reads are done
+    for task in tasks:
+        lines, failed = await task
+        summary.errors += failed
+        for line in lines:
+            print(line)
+
+async def run_write(parsed: Dict[str, Any], command: str, group: WriteGroup, summary: BatchSummary):
+    db = group.session()
+    with track_queries(command, budget_of(parsed["method"])):
+        try:
+            result = await invoke(parsed["method"], *parsed["args"], db)
+            for line in result_lines(result):
+                print(line)
+        except Exception as e:
+            # Only this command's savepoint
+            db.rollback()
+            summary.errors += 1
+            print(f"Error executing command: {str(e)}")
+    group.done()
+
+async def run_job(parsed: Dict[str, Any], command: str, summary: BatchSummary):
+    with SessionLocal() as db, track_queries(command, budget_of(parsed["method"])):
+        try:
+            result = await invoke(parsed["method"], *parsed["args"], db)
+            for line in result_lines(result):
+                print(line)
+        except Exception as e:
+            db.rollback()
+            summary.errors += 1
+            print(f"Error executing command: {str(e)}")
+
+async def run_script(
+    lines: Iterable[str],
+    transaction_size: int = CLI_TRANSACTION_SIZE,
+    concurrency: int = CLI_READ_CONCURRENCY,
+) -> BatchSummary:
+    summary = BatchSummary()
+    steps = []
+    for number, command in read_script(lines):
+        parsed = parse_command(command)
+        summary.commands += 1
+        if not parsed["valid"]:
+            summary.errors += 1
+            steps.append(("invalid", number, command, parsed))
+            continue
+        steps.append((command_kind(parsed), number, command, parsed))
+
+    group = WriteGroup(transaction_size, summary)
+    reads = []
+    try:
+        for kind, number, command, parsed in steps:
+            if kind != "read" and reads:
+                await run_reads(reads, concurrency, summary)
+                reads = []
+
+            if kind == "read":
+                # Reads see everything written before them
+                group.commit()
+                summary.reads += 1
+                reads.append((number, command, parsed))
+            elif kind == "write":
+                summary.writes += 1
+                await run_write(parsed, command, group, summary)
+            elif kind == "job":
+                group.commit()
+                summary.jobs += 1
+                await run_job(parsed, command, summary)
+            elif kind == "invalid":
+                print(f"Line {number}: unknown/invalid command: {command}")
+        if reads:
+            await run_reads(reads, concurrency, summary)
+    finally:
+        group.close()
+
+    print(summary.report(), file=sys.stderr)
+    return summary
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Read-through cache for single entities, keyed by (entity, id).
+# Values are plain dicts of column values so they can outlive the session
+# they were loaded in. Every process has its own in-memory cache unless the
+# redis backend is configured, so TTL bounds how stale a row changed by
+# another process can get.
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+Key = Tuple[str, Hashable]
+
+
+class LRUCache:
+    # Calls never wait on I/O, async code uses them inline
+    blocking = False
+
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Key, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Key) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Key, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: Key):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self, entity: Optional[str] = None):
+        with self._lock:
+            if entity is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if key[0] == entity]:
+                del self._data[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+
+# Shared cache for several API workers and the CLI. Size is bounded by the
+# redis maxmemory policy, evictions are the server's evicted_keys counter
+class RedisCache:
+    # Every call is a network round trip on the blocking client, see
+    # cache_get below for async code
+    blocking = True
+
+    def __init__(self, url: str = CACHE_REDIS_URL, ttl: float = CACHE_TTL, prefix: str = "sales"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def _name(self, key: Key) -> str:
+        return f"{self.prefix}:{key[0]}:{key[1]}"
+
+    def get(self, key: Key) -> Optional[Any]:
+        raw = self.client.get(self._name(key))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key: Key, value: Any):
+        self.client.set(self._name(key), pickle.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, *keys: Key):
+        if keys:
+            self.client.delete(*[self._name(key) for key in keys])
+
+    def clear(self, entity: Optional[str] = None):
+        pattern = f"{self.prefix}:{entity}:*" if entity else f"{self.prefix}:*"
+        batch = []
+        for name in self.client.scan_iter(match=pattern, count=1000):
+            batch.append(name)
+            if len(batch) >= 1000:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.client.info("stats").get("evicted_keys", 0),
+        }
+
+
+class NullCache:
+    blocking = False
+
+    def get(self, key: Key) -> Optional[Any]:
+        return None
+
+    def set(self, key: Key, value: Any):
+        pass
+
+    def delete(self, *keys: Key):
+        pass
+
+    def clear(self, entity: Optional[str] = None):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "none"}
+
+
+def create_cache():
+    if CACHE_BACKEND == "memory":
+        return LRUCache()
+    if CACHE_BACKEND == "redis":
+        return RedisCache()
+    if CACHE_BACKEND == "none":
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+
+entity_cache = create_cache()
+
+
+# Async endpoints use these instead of calling a blocking backend on the
+# event loop, where every redis round trip would stall all other requests.
+# Blocking calls run in the default thread pool, in-memory ones inline
+async def cache_get(key: Key) -> Optional[Any]:
+    if entity_cache.blocking:
+        return await asyncio.to_thread(entity_cache.get, key)
+    return entity_cache.get(key)
+
+async def cache_set(key: Key, value: Any):
+    if entity_cache.blocking:
+        await asyncio.to_thread(entity_cache.set, key, value)
+    else:
+        entity_cache.set(key, value)
+
+async def cache_delete(*keys: Key):
+    if entity_cache.blocking:
+        await asyncio.to_thread(entity_cache.delete, *keys)
+    else:
+        entity_cache.delete(*keys)
+
+# For sync code that the API runs through AsyncSession.run_sync, which
+# executes on the event loop thread: yields a delete function that sends
+# blocking deletes from the thread pool. They are all awaited on exit, so a
+# client reads its own writes in the next request
+@asynccontextmanager
+async def threaded_deletes():
+    if not entity_cache.blocking:
+        yield entity_cache.delete
+        return
+    loop = asyncio.get_running_loop()
+    pending = []
+    try:
+        yield lambda *keys: pending.append(loop.run_in_executor(None, entity_cache.delete, *keys))
+    finally:
+        await asyncio.gather(*pending)
@@ -0,0 +1,85 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.orm import Session
+from session import env_float
+from models import Product, Customer, Purchase, ChangeTombstone
+
+# Change feed: inserted, updated and deleted rows of one entity in the order
+# they were written, read from a position token onwards, so a consumer pays
+# for the changes since its last sync rather than for the whole table.
+# Rows carry (change_xid, change_seq): the writing transaction and a value
+# of the shared change_seq sequence, see ChangeTracked in models.py. A
+# transaction can commit after another one that drew later sequence values,
+# so ordering by change_seq alone would let a consumer move past rows that
+# weren't visible yet. The feed is therefore ordered by (change_xid,
+# change_seq) and only returns changes of transactions older than the
+# snapshot xmin, which have all finished. A long-running write transaction
+# holds the feed back until it ends. PostgreSQL only.
+
+CHANGE_ENTITIES = {
+    "products": (Product, "product"),
+    "customers": (Customer, "customer"),
+    "purchases": (Purchase, "purchase"),
+}
+
+# Sleep between polls of long-poll and stream requests
+CHANGE_FEED_POLL_SECONDS = env_float("CHANGE_FEED_POLL_SECONDS", 0.5)
+
+Position = Tuple[int, int]
+
+def finished_before(db: Session) -> int:
+    # Every transaction with a lower id has committed or rolled back
+    return db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar_one()
+
+def row_columns(model) -> List[Any]:
+    return [column for column in model.__table__.columns if column.key != "change_xid"]
+
+def _after(columns: Sequence[Any], position: Optional[Position], xmin: int) -> List[Any]:
+    xid, seq = columns
+    conditions = [xid < xmin]
+    if position is not None:
+        conditions.append(tuple_(xid, seq) > tuple_(*position))
+    return conditions
+
+# Up to limit changes after position, each with its own position
+def read_changes(db: Session, entity: str, position: Optional[Position], limit: int) -> List[Tuple[Position, Dict[str, Any]]]:
+    model, name = CHANGE_ENTITIES[entity]
+    pk = model.__mapper__.primary_key[0]
+    xmin = finished_before(db)
+
+    rows = db.execute(
+        select(model.change_xid, *row_columns(model))
+        .where(*_after((model.change_xid, model.change_seq), position, xmin))
+        .order_by(model.change_xid, model.change_seq)
+        .limit(limit)
+    ).mappings()
+    changes = [
+        (row["change_xid"], row["change_seq"], {
+            "op": "upsert",
+            "id": row[pk.key],
+            "change_seq": row["change_seq"],
+            "row": {key: value for key, value in row.items() if key != "change_xid"},
+        })
+        for row in rows
+    ]
+
+    tombstones = db.execute(
+        select(ChangeTombstone)
+        .where(
+            ChangeTombstone.entity == name,
+            *_after((ChangeTombstone.change_xid, ChangeTombstone.change_seq), position, xmin),
+        )
+        .order_by(ChangeTombstone.change_xid, ChangeTombstone.change_seq)
+        .limit(limit)
+    ).scalars()
+    for tombstone in tombstones:
+        if tombstone.entity_id is None:
+            # The table was truncated, consumers start over
+            change = {"op": "truncate"}
+        else:
+            change = {"op": "delete", "id": tombstone.entity_id}
+        change.update(change_seq=tombstone.change_seq, deleted_at=tombstone.deleted_at)
+        changes.append((tombstone.change_xid, tombstone.change_seq, change))
+
+    changes.sort(key=lambda change: (change[0], change[1]))
+    return [((xid, seq), change) for xid, seq, change in changes[:limit]]
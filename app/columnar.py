@@ -0,0 +1,266 @@
+import io
+import os
+import threading
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import insert, select, text, Select
+from sqlalchemy.orm import Session
+from session import env_int
+from models import Product, Customer, Purchase
+from analytics import range_conditions
+from export import purchase_details_statement
+
+# Parquet and Arrow IPC export/import of whole tables and of the purchase
+# details join, for offline analysis and for loading snapshots into other
+# databases. Needs the optional pyarrow package.
+# On PostgreSQL the export runs one COPY ... TO STDOUT whose CSV is piped
+# straight into pyarrow's multithreaded CSV reader, and the import writes
+# every record batch back as CSV into COPY ... FROM STDIN, so no row ever
+# becomes a Python object. Other backends go through plain row batches.
+# Either way only one row group is held in memory at a time.
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+EXPORT_ROW_GROUP_SIZE = env_int("EXPORT_ROW_GROUP_SIZE", 100000)
+# Bytes of CSV parsed per block on the COPY path
+COPY_BLOCK_SIZE = 4 << 20
+
+# dataset -> (table to import into or None, columns with their arrow types)
+DATASET_COLUMNS = {
+    "products": (Product.__table__, [
+        ("product_id", "int64"),
+        ("name", "string"),
+        ("manufacturer", "string"),
+        ("unit", "string"),
+    ]),
+    "customers": (Customer.__table__, [
+        ("customer_id", "int64"),
+        ("name", "string"),
+        ("address", "string"),
+        ("phone", "string"),
+        ("contact_person", "string"),
+    ]),
+    "purchases": (Purchase.__table__, [
+        ("purchase_id", "int64"),
+        ("product_id", "int64"),
+        ("customer_id", "int64"),
+        ("quantity", "float64"),
+        ("delivery_date", "timestamp"),
+        ("price_per_unit", "float64"),
+    ]),
+    "details": (None, [
+        ("purchase_id", "int64"),
+        ("product_name", "string"),
+        ("customer_name", "string"),
+        ("quantity", "float64"),
+        ("delivery_date", "timestamp"),
+        ("price_per_unit", "float64"),
+    ]),
+}
+
+# Tables are loaded in this order so foreign keys resolve
+IMPORT_ORDER = ("products", "customers", "purchases")
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as err:
+        raise RuntimeError("Parquet/Arrow export and import need the pyarrow package.") from err
+    return pyarrow
+
+def dataset_schema(dataset: str):
+    pa = _pyarrow()
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in DATASET_COLUMNS[dataset][1]])
+
+def dataset_statement(dataset: str, date_from: Optional[date] = None, date_to: Optional[date] = None) -> Select:
+    if dataset not in DATASET_COLUMNS:
+        raise ValueError(f"Unknown dataset: {dataset}. Available: {', '.join(DATASET_COLUMNS)}")
+    if dataset in ("products", "customers"):
+        if date_from or date_to:
+            raise ValueError("Date ranges only apply to purchases and details.")
+        table = DATASET_COLUMNS[dataset][0]
+        columns = [table.c[name] for name, _ in DATASET_COLUMNS[dataset][1]]
+        return select(*columns).order_by(columns[0])
+    statement = purchase_details_statement() if dataset == "details" else select(
+        *[Purchase.__table__.c[name] for name, _ in DATASET_COLUMNS["purchases"][1]]
+    )
+    return statement.where(*range_conditions(Purchase.delivery_date, date_from, date_to)).order_by(Purchase.purchase_id)
+
+def columnar_format(path: str, export_format: Optional[str] = None) -> str:
+    if export_format is None:
+        export_format = "parquet" if path.endswith(".parquet") else "arrow"
+    if export_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unsupported format: {export_format}. Available: {', '.join(COLUMNAR_FORMATS)}")
+    return export_format
+
+
+# Export
+
+# COPY TO STDOUT blocks until the whole result is written, so it runs on its
+# own thread and writes into a pipe the CSV reader consumes
+def _copy_out_batches(db: Session, statement: Select, schema) -> Iterator[Any]:
+    pa = _pyarrow()
+    connection = db.connection().connection
+    cursor = connection.cursor()
+    compiled = statement.compile(dialect=db.get_bind().dialect)
+    query = cursor.mogrify(str(compiled), compiled.params).decode()
+
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        with open(write_fd, "wb") as sink:
+            try:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", sink)
+            except Exception as err:
+                errors.append(err)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        with open(read_fd, "rb") as source:
+            # The CSV reader refuses an empty stream
+            if not source.peek(1):
+                return
+            reader = pa.csv.open_csv(
+                source,
+                read_options=pa.csv.ReadOptions(column_names=schema.names, block_size=COPY_BLOCK_SIZE),
+                convert_options=pa.csv.ConvertOptions(column_types=schema),
+            )
+            for batch in reader:
+                yield batch
+    except pa.ArrowInvalid:
+        # A failed COPY leaves a truncated stream, report the database error
+        if not errors:
+            raise
+    finally:
+        producer.join()
+        cursor.close()
+    if errors:
+        raise errors[0]
+
+def _row_batches(db: Session, statement: Select, schema, batch_size: int) -> Iterator[Any]:
+    pa = _pyarrow()
+    result = db.execute(statement.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+            schema=schema,
+        )
+
+# Row groups of row_group_size rows out of batches of any size
+def _row_groups(batches: Iterable[Any], schema, row_group_size: int) -> Iterator[Any]:
+    pa = _pyarrow()
+    pending, rows = [], 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= row_group_size:
+            table = pa.Table.from_batches(pending, schema=schema)
+            yield table.slice(0, row_group_size)
+            rest = table.slice(row_group_size)
+            pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending, schema=schema)
+
+def export_dataset(
+    db: Session,
+    dataset: str,
+    path: str,
+    export_format: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    row_group_size: int = EXPORT_ROW_GROUP_SIZE,
+) -> Dict[str, Any]:
+    pa = _pyarrow()
+    export_format = columnar_format(path, export_format)
+    statement = dataset_statement(dataset, date_from, date_to)
+    schema = dataset_schema(dataset)
+    if db.get_bind().dialect.name == "postgresql":
+        batches = _copy_out_batches(db, statement, schema)
+    else:
+        batches = _row_batches(db, statement, schema, min(row_group_size, 10000))
+
+    rows = groups = 0
+    if export_format == "parquet":
+        writer = pa.parquet.ParquetWriter(path, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    with writer:
+        for group in _row_groups(batches, schema, row_group_size):
+            if export_format == "parquet":
+                writer.write_table(group, row_group_size=row_group_size)
+            else:
+                for batch in group.to_batches():
+                    writer.write_batch(batch)
+            rows += group.num_rows
+            groups += 1
+    return {"dataset": dataset, "format": export_format, "rows": rows, "row_groups": groups, "bytes": os.path.getsize(path)}
+
+
+# Import
+
+def read_batches(path: str, export_format: Optional[str] = None, batch_size: int = EXPORT_ROW_GROUP_SIZE) -> Tuple[Any, Iterator[Any]]:
+    pa = _pyarrow()
+    if columnar_format(path, export_format) == "parquet":
+        parquet_file = pa.parquet.ParquetFile(path)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=batch_size)
+    reader = pa.ipc.open_file(path)
+    return reader.schema, (reader.get_batch(index) for index in range(reader.num_record_batches))
+
+def _copy_in_batch(db: Session, table, batch):
+    pa = _pyarrow()
+    buffer = io.BytesIO()
+    pa.csv.write_csv(batch, buffer, write_options=pa.csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(batch.schema.names)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+# Explicit ids were loaded, so the next generated id has to come after them
+def _advance_sequence(db: Session, table, pk: str):
+    db.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{pk}'), "
+        f"(SELECT COALESCE(MAX({pk}), 0) + 1 FROM {table.name}), false)"
+    ))
+
+def import_dataset(
+    db: Session,
+    dataset: str,
+    path: str,
+    export_format: Optional[str] = None,
+    batch_size: int = EXPORT_ROW_GROUP_SIZE,
+) -> Dict[str, Any]:
+    if dataset not in IMPORT_ORDER:
+        raise ValueError(f"Only {', '.join(IMPORT_ORDER)} can be imported.")
+    table, columns = DATASET_COLUMNS[dataset]
+    names = [name for name, _ in columns]
+    schema, batches = read_batches(path, export_format, batch_size)
+    missing = [name for name in names if name not in schema.names]
+    if missing:
+        raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+
+    postgresql = db.get_bind().dialect.name == "postgresql"
+    target = dataset_schema(dataset)
+    rows = 0
+    try:
+        for batch in batches:
+            batch = batch.select(names).cast(target)
+            if postgresql:
+                _copy_in_batch(db, table, batch)
+            elif batch.num_rows:
+                db.execute(insert(table), batch.to_pylist())
+            rows += batch.num_rows
+        if postgresql:
+            _advance_sequence(db, table, names[0])
+        # One transaction, a failed load leaves the table as it was
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"dataset": dataset, "rows": rows}
@@ -1,139 +1,256 @@
-import random
-from datetime import datetime, timedelta
-from typing import Dict, Any, Callable
+import os
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
 import inspect
+from sqlalchemy import delete, select, text
 from sqlalchemy.orm import Session
 from models import Product, Customer, Purchase
+from cache import entity_cache
+from statements import entity_pk, lookup_row, insert_row, delete_row
+from partitions import RETENTION_BATCH_SIZE, purge_purchases_before
+from querybudget import query_budget
+from pricing import DEFAULT_QUANTITY_OVER, REPRICE_BATCH_SIZE, reprice_purchases
+from analytics import customer_purchases, product_sales
+from aggregates import live_product_sales, summary_product_sales
+from olap import olap_snapshot
+from export import STREAM_BATCH_SIZE, EXPORT_FORMATS, iter_purchase_details, encode_rows
+from generator import GENERATORS, DEFAULT_CHUNK_SIZE, generate_parallel
 
-# Functions for generating random data
-
-def get_random_company_name() -> str:
-    prefixes = ["Tech", "Global", "Super", "Mega", "Pro", "Smart", "Elite", "Prime", "First", "Best"]
-    suffixes = ["Corp", "Systems", "Solutions", "Industries", "Group", "Partners", "International", "Ltd", "Inc", "Co"]
-    return f"{random.choice(prefixes)} {random.choice(suffixes)}"
-
-def get_random_manufacturer() -> str:
-    manufacturers = [
-        "TechPro Manufacturing",
-        "GlobalTech Industries",
-        "Innovative Solutions",
-        "Quality Producers",
-        "Premium Products",
-        "Standard Manufacturing",
-        "Elite Industries",
-        "Professional Products",
-        "Advanced Systems",
-        "Core Manufacturing"
-    ]
-    return random.choice(manufacturers)
-
-def get_random_unit() -> str:
-    units = ["piece", "kg", "liter", "meter", "set", "box", "pack", "ton", "pair", "bundle"]
-    return random.choice(units)
-
-def get_random_product_name() -> str:
-    products = [
-        "Laptop Computer",
-        "Office Chair",
-        "Desk Lamp",
-        "Printer Paper",
-        "Coffee Maker",
-        "Filing Cabinet",
-        "Whiteboard",
-        "Phone Charger",
-        "USB Drive",
-        "Wireless Mouse"
-    ]
-    return random.choice(products)
-
-def get_random_phone() -> str:
-    return f"+7({random.randint(900, 999)}){random.randint(1000000, 9999999)}"
-
-def get_random_address() -> str:
-    streets = ["Main", "Park", "Lake", "Hill", "Forest", "River", "Mountain", "Valley", "Spring", "Meadow"]
-    cities = ["Moscow", "Saint Petersburg", "Novosibirsk", "Yekaterinburg", "Kazan", "Nizhny Novgorod", "Samara"]
-    return f"{random.randint(1, 100)} {random.choice(streets)} St., {random.choice(cities)}"
+# Rows removed per transaction by batched deletes
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "10000"))
 
-def get_random_person_name() -> str:
-    first_names = ["Ivan", "Alexander", "Dmitry", "Mikhail", "Sergey", "Anna", "Elena", "Maria", "Olga", "Natalia"]
-    last_names = ["Ivanov", "Petrov", "Sidorov", "Smirnov", "Kuznetsov", "Popov", "Sokolov", "Lebedev", "Kozlov"]
-    return f"{random.choice(first_names)} {random.choice(last_names)}"
 
-def get_random_quantity() -> int:
-    return round(random.uniform(1, 1000), 2)
-
-def get_random_price() -> float:
-    return round(random.uniform(10, 10000), 2)
+# Conversion function to datetime
+def to_datetime(input_str: str) -> datetime:
+    try:
+        return datetime.strptime(input_str, "%Y-%m-%d_%H:%M:%S")
+    except ValueError as err:
+        raise ValueError(f"Invalid date/time format: {input_str}") from err
 
-def get_random_date(start_date: datetime = None) -> datetime:
-    if start_date is None:
-        start_date = datetime.now() - timedelta(days=365)
-    max_days = (datetime.now() + timedelta(days=30) - start_date).days
-    days_to_add = random.randint(0, max_days)
-    return start_date + timedelta(days=days_to_add)
 
 
-def generate_random_products(count: int, db: Session):
-    for _ in range(count):
-        name = get_random_product_name()
-        manufacturer = get_random_manufacturer()
-        unit = get_random_unit()
+# Splits "--key value" options from positional arguments
+def parse_options(args: Sequence[str]) -> Tuple[List[str], Dict[str, str]]:
+    positional, options = [], {}
+    args = iter(args)
+    for arg in args:
+        if arg.startswith("--"):
+            value = next(args, None)
+            if value is None:
+                raise ValueError(f"Missing value for option {arg}")
+            options[arg[2:].replace("-", "_")] = value
+        else:
+            positional.append(arg)
+    return positional, options
+
+# generate <count> [--chunk-size N] [--workers N] [--seed N]
+def run_generate(entity: str, *args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError("Usage: generate <count> [--chunk-size N] [--workers N] [--seed N]")
+    count = int(positional[0])
+    chunk_size = int(options.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+    if "workers" in options or "seed" in options:
+        return generate_parallel(
+            entity,
+            count,
+            workers=int(options.get("workers", 1)),
+            seed=int(options["seed"]) if "seed" in options else None,
+            chunk_size=chunk_size,
+        )
+    return GENERATORS[entity](count, db, chunk_size=chunk_size)
 
-        product = Product(name=name, manufacturer=manufacturer, unit=unit)
-        db.add(product)
 
-    db.commit()
-    return f"{count} random products generated successfully."
 
+# explain [all|<query name>]
+def run_explain(*args):
+    from explain import explain_queries, format_report
+    *args, db = args
+    name = args[0] if args and args[0] != "all" else None
+    return [format_report(report) for report in explain_queries(db, name)]
 
-def generate_random_customers(count: int, db: Session):
-    for _ in range(count):
-        name = get_random_person_name()
-        address = get_random_address()
-        phone = get_random_phone()
-        contact_person = get_random_person_name()
 
-        customer = Customer(name=name, address=address, phone=phone, contact_person=contact_person)
-        db.add(customer)
+# export <products|customers|purchases|details> <path> [--format parquet|arrow]
+#     [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--row-group-size N]
+def run_export(dataset: str, *args):
+    from columnar import EXPORT_ROW_GROUP_SIZE, export_dataset
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError(
+            "Usage: export <dataset> <path> [--format parquet|arrow] [--date-from YYYY-MM-DD] "
+            "[--date-to YYYY-MM-DD] [--row-group-size N]"
+        )
+    result = export_dataset(
+        db,
+        dataset,
+        positional[0],
+        export_format=options.get("format"),
+        **date_range_options(options),
+        row_group_size=int(options.get("row_group_size", EXPORT_ROW_GROUP_SIZE)),
+    )
+    return (
+        f"{result['rows']} {dataset} rows exported to {positional[0]} ({result['format']}, "
+        f"{result['row_groups']} row groups, {result['bytes']} bytes)."
+    )
 
-    db.commit()
-    return f"{count} random customers generated successfully."
 
+# import <products|customers|purchases> <path> [--format parquet|arrow]
+def run_import(dataset: str, *args):
+    from columnar import import_dataset
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError("Usage: import <dataset> <path> [--format parquet|arrow]")
+    result = import_dataset(db, dataset, positional[0], export_format=options.get("format"))
+    entity_cache.clear(dataset.rstrip("s"))
+    return f"{result['rows']} {dataset} rows imported from {positional[0]}."
+
+
+# purchase purge-before <YYYY-MM-DD> [--mode drop|truncate] [--batch-size N]
+def run_purge(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError("Usage: purge-before <YYYY-MM-DD> [--mode drop|truncate] [--batch-size N]")
+    cutoff = datetime.strptime(positional[0], "%Y-%m-%d").date()
+    return purge_purchases_before(
+        db,
+        cutoff,
+        mode=options.get("mode", "drop"),
+        batch_size=int(options.get("batch_size", RETENTION_BATCH_SIZE)),
+    )
 
-def generate_random_purchases(count: int, db: Session):
-    products = db.query(Product).all()
-    customers = db.query(Customer).all()
 
-    if not products or not customers:
-        return "Error: There must be at least one product and one customer in the database to generate purchases."
+def parse_date(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
 
-    for _ in range(count):
-        product = random.choice(products)
-        customer = random.choice(customers)
-        quantity = get_random_quantity()
-        delivery_date = get_random_date()
-        price_per_unit = get_random_price()
+def date_range_options(options: Dict[str, str]) -> Dict[str, Any]:
+    return {name: parse_date(options[name]) if name in options else None for name in ("date_from", "date_to")}
 
-        purchase = Purchase(
-            product_id=product.product_id,
-            customer_id=customer.customer_id,
-            quantity=quantity,
-            delivery_date=delivery_date,
-            price_per_unit=price_per_unit,
+# purchase reprice <new price> [--product-id N] [--customer-id N] [--date-from YYYY-MM-DD]
+#     [--date-to YYYY-MM-DD] [--quantity-over N] [--batch-size N] [--dry-run yes]
+def run_reprice(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError(
+            "Usage: reprice <new price> [--product-id N] [--customer-id N] [--date-from YYYY-MM-DD] "
+            "[--date-to YYYY-MM-DD] [--quantity-over N] [--batch-size N] [--dry-run yes]"
         )
-        db.add(purchase)
-
-    db.commit()
-    return f"{count} random purchases generated successfully."
 
+    def option(name, parse):
+        return parse(options[name]) if name in options else None
+
+    result = reprice_purchases(
+        db,
+        float(positional[0]),
+        product_id=option("product_id", int),
+        customer_id=option("customer_id", int),
+        **date_range_options(options),
+        quantity_over=float(options.get("quantity_over", DEFAULT_QUANTITY_OVER)),
+        dry_run=options.get("dry_run", "no").lower() in ("1", "yes", "true"),
+        batch_size=int(options.get("batch_size", REPRICE_BATCH_SIZE)),
+    )
+    if result["dry_run"]:
+        return f"{result['matched']} purchases match, {result['to_update']} would be repriced (dry run)."
+    return f"{result['matched']} purchases matched, {result['updated']} repriced in {result['batches']} batch(es)."
 
-# Conversion function to datetime
-def to_datetime(input_str: str) -> datetime:
-    try:
-        return datetime.strptime(input_str, "%Y-%m-%d_%H:%M:%S")
-    except ValueError as err:
-        raise ValueError(f"Invalid date/time format: {input_str}") from err
 
+# ------------------------------
+# 📊 Analytics Queries
+# ------------------------------
+def format_analytics(report: Dict[str, Any]) -> List[str]:
+    lines = [", ".join(f"{key}: {value}" for key, value in report.items() if key != "months")]
+    lines += [
+        f"{month['month']:%Y-%m}: {month['purchase_count']} purchases, "
+        f"quantity {month['total_quantity']:.2f}, revenue {month['total_revenue']:.2f}"
+        for month in report["months"]
+    ]
+    return lines
+
+# query 1 <manufacturer> [--unit U]
+def query_products_by_manufacturer(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if not positional:
+        raise ValueError("Usage: query 1 <manufacturer> [--unit U]")
+    # Manufacturer names contain spaces
+    conditions = [Product.manufacturer == " ".join(positional)]
+    if "unit" in options:
+        conditions.append(Product.unit == options["unit"])
+    products = db.scalars(select(Product).where(*conditions).order_by(Product.product_id))
+    return (f"{product.product_id}: {product.name}, {product.manufacturer}, {product.unit}" for product in products)
+
+# --source olap reads the in-memory snapshot, loaded by the first such
+# command and refreshed once older than OLAP_REFRESH_SECONDS
+def olap_source(options: Dict[str, str], db: Session) -> bool:
+    if options.get("source") != "olap":
+        return False
+    olap_snapshot.refresh_if_stale(db)
+    return True
+
+# query 2 <customer id> [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--source live|olap]
+def query_customer_purchases(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError("Usage: query 2 <customer id> [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--source live|olap]")
+    customer_id = int(positional[0])
+    if not get_cached(db, Customer, "customer", customer_id):
+        return f"Customer with ID {customer_id} not found."
+    if olap_source(options, db):
+        return format_analytics(olap_snapshot.report(**date_range_options(options), customer_id=customer_id))
+    return format_analytics(customer_purchases(db, customer_id, **date_range_options(options)))
+
+# query 4 [<product id>] [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--source summary|live|olap]
+# Without a product id: totals for every product
+def query_product_sales(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    olap = olap_source(options, db)
+    if not positional:
+        live = options.get("source") == "live" or db.get_bind().dialect.name != "postgresql"
+        if olap:
+            rows = olap_snapshot.product_sales(**date_range_options(options))
+        else:
+            rows = db.execute(live_product_sales() if live else summary_product_sales()).mappings()
+        return (
+            f"{row['product_id']}: {row['purchase_count']} purchases, "
+            f"quantity {row['total_quantity']:.2f}, revenue {row['total_revenue']:.2f}"
+            for row in rows
+        )
+    product_id = int(positional[0])
+    if not get_cached(db, Product, "product", product_id):
+        return f"Product with ID {product_id} not found."
+    if olap:
+        return format_analytics(olap_snapshot.report(**date_range_options(options), product_id=product_id))
+    report = product_sales(db, product_id, source=options.get("source", "summary"), **date_range_options(options))
+    return format_analytics(report)
+
+# query 5 <product|customer|manufacturer|unit> [--metric total_revenue|total_quantity|purchase_count]
+#   [--limit N] [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--manufacturer M] [--unit U]
+# Top-N from the in-memory snapshot
+def query_top(*args):
+    *args, db = args
+    positional, options = parse_options(args)
+    if len(positional) != 1:
+        raise ValueError(
+            "Usage: query 5 <product|customer|manufacturer|unit> [--metric total_revenue|total_quantity|purchase_count] "
+            "[--limit N] [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD] [--manufacturer M] [--unit U]"
+        )
+    olap_snapshot.refresh_if_stale(db)
+    rows = olap_snapshot.top(
+        positional[0],
+        options.get("metric", "total_revenue"),
+        int(options.get("limit", 10)),
+        manufacturer=options.get("manufacturer"),
+        unit=options.get("unit"),
+        **date_range_options(options),
+    )
+    return (", ".join(f"{key}: {value}" for key, value in row.items()) for row in rows)
 
 
 # Command Mapping
@@ -143,24 +260,51 @@ method_dict = {
         "get": lambda product_id, db: get_product(product_id, db),
         "get-all": lambda db, *args: get_all_products(db),
         "delete": lambda product_id, db: delete_product(product_id, db),
-        "delete-all": lambda db: delete_all_products(db),
-        "generate": lambda count, db: generate_random_products(int(count), db),
+        "delete-all": query_budget(None)(lambda *args: run_delete_all(delete_all_products, *args)),
+        "generate": lambda *args: run_generate("product", *args),
     },
     "customer": {
         "create": lambda name, address, phone, contact_person, db: create_customer(name, address, phone, contact_person, db),
         "get": lambda customer_id, db: get_customer(customer_id, db),
         "get-all": lambda db, *args: get_all_customers(db),
         "delete": lambda customer_id, db: delete_customer(customer_id, db),
-        "delete-all": lambda db: delete_all_customers(db),
-        "generate": lambda count, db: generate_random_customers(int(count), db),
+        "delete-all": query_budget(None)(lambda *args: run_delete_all(delete_all_customers, *args)),
+        "generate": lambda *args: run_generate("customer", *args),
     },
     "purchase": {
         "create": lambda product_id, customer_id, quantity, delivery_date, price_per_unit, db: create_purchase(product_id, customer_id, quantity, delivery_date, price_per_unit, db),
         "get": lambda purchase_id, db: get_purchase(purchase_id, db),
         "get-all": lambda db, *args: get_all_purchases(db),
+        "details": lambda *args: get_purchase_details(*args),
         "delete": lambda purchase_id, db: delete_purchase(purchase_id, db),
-        "delete-all": lambda db: delete_all_purchases(db),
-        "generate": lambda count, db: generate_random_purchases(int(count), db),
+        "delete-all": query_budget(None)(lambda *args: run_delete_all(delete_all_purchases, *args)),
+        # Batch jobs repeat the same statement per batch by design
+        "purge-before": query_budget(None)(lambda *args: run_purge(*args)),
+        "reprice": query_budget(None)(lambda *args: run_reprice(*args)),
+        "generate": lambda *args: run_generate("purchase", *args),
+    },
+    "query": {
+        "1": lambda *args: query_products_by_manufacturer(*args),
+        "2": lambda *args: query_customer_purchases(*args),
+        "3": query_budget(None)(lambda *args: run_reprice(*args)),
+        "4": lambda *args: query_product_sales(*args),
+        "5": lambda *args: query_top(*args),
+    },
+    # Columnar snapshots, loaded through COPY in one transaction per file
+    "export": {
+        "products": lambda *args: run_export("products", *args),
+        "customers": lambda *args: run_export("customers", *args),
+        "purchases": lambda *args: run_export("purchases", *args),
+        "details": lambda *args: run_export("details", *args),
+    },
+    "import": {
+        "products": query_budget(None)(lambda *args: run_import("products", *args)),
+        "customers": query_budget(None)(lambda *args: run_import("customers", *args)),
+        "purchases": query_budget(None)(lambda *args: run_import("purchases", *args)),
+    },
+    "explain": {
+        "all": lambda *args: run_explain(*args),
+        "query": lambda *args: run_explain(*args),
     },
 }
 
@@ -168,42 +312,101 @@ method_dict = {
 
 
 
+# Entity lookups go through the shared entity cache, returns a dict of
+# column values or None
+def get_cached(db: Session, model, entity: str, entity_id) -> Optional[Dict[str, Any]]:
+    key = (entity, int(entity_id))
+    row = entity_cache.get(key)
+    if row is None:
+        row = lookup_row(db, model, int(entity_id))
+        if row is None:
+            return None
+        entity_cache.set(key, row)
+    return row
+
+
+# Bulk removal helpers
+
+def has_rows(db: Session, model) -> bool:
+    return db.query(db.query(model).exists()).scalar()
+
+# Without a batch size the table is truncated, taking purchases along
+# through CASCADE. With one (or on databases without TRUNCATE) rows are
+# deleted batch_size at a time, committing after each batch to bound lock
+# time and transaction size. children are (model, foreign key) pairs of
+# the rows that reference a batch: they are deleted first, in batches of
+# their own, so the cascade of the parent delete has nothing left to do
+def truncate_or_delete(db: Session, model, pk, batch_size: Optional[int] = None, children: Sequence[Tuple[Any, Any]] = ()):
+    if batch_size is None and db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"TRUNCATE {model.__tablename__} CASCADE"))
+        db.commit()
+        return
+
+    batch_size = batch_size or DELETE_BATCH_SIZE
+    while True:
+        ids = db.scalars(select(pk).order_by(pk).limit(batch_size)).all()
+        if not ids:
+            return
+        for child, foreign_key in children:
+            delete_referencing(db, child, foreign_key, ids, batch_size)
+        db.execute(delete(model).where(pk.in_(ids)))
+        db.commit()
+        if len(ids) < batch_size:
+            return
+
+def delete_referencing(db: Session, model, foreign_key, parent_ids: Sequence[int], batch_size: int):
+    pk = entity_pk(model)
+    while True:
+        batch = select(pk).where(foreign_key.in_(parent_ids)).limit(batch_size).scalar_subquery()
+        result = db.execute(delete(model).where(pk.in_(batch)))
+        db.commit()
+        if result.rowcount < batch_size:
+            return
+
+# delete-all [--batch-size N]
+def run_delete_all(delete_all: Callable, *args):
+    *args, db = args
+    _, options = parse_options(args)
+    batch_size = int(options["batch_size"]) if "batch_size" in options else None
+    return delete_all(db, batch_size=batch_size)
+
+
 # ------------------------------
 # 🛠️ Product Functions
 # ------------------------------
 def create_product(name, manufacturer, unit, db: Session):
-    product = Product(name=name, manufacturer=manufacturer, unit=unit)
-    db.add(product)
+    product = insert_row(db, Product, {"name": name, "manufacturer": manufacturer, "unit": unit})
     db.commit()
-    db.refresh(product)
-    return f"Product created: {product.product_id}, {product.name}, {product.manufacturer}, {product.unit}"
+    entity_cache.set(("product", product["product_id"]), product)
+    return f"Product created: {product['product_id']}, {product['name']}, {product['manufacturer']}, {product['unit']}"
 
 def get_product(product_id, db: Session):
-    product = db.query(Product).filter(Product.product_id == product_id).first()
+    product = get_cached(db, Product, "product", product_id)
     if not product:
         return f"Product with ID {product_id} not found."
-    return f"Product: {product.product_id}, {product.name}, {product.manufacturer}, {product.unit}"
+    return f"Product: {product['product_id']}, {product['name']}, {product['manufacturer']}, {product['unit']}"
 
 def get_all_products(db: Session):
-    products = db.query(Product).all()
-    return [f"{product.product_id}: {product.name}, {product.manufacturer}, {product.unit}" for product in products]
+    products = db.query(Product).order_by(Product.product_id).yield_per(STREAM_BATCH_SIZE)
+    return (f"{product.product_id}: {product.name}, {product.manufacturer}, {product.unit}" for product in products)
 
 def delete_product(product_id, db: Session):
-    product = db.query(Product).filter(Product.product_id == product_id).first()
-    if not product:
+    if not delete_row(db, Product, int(product_id)):
+        db.rollback()
         return f"Product with ID {product_id} not found."
-    db.delete(product)
     db.commit()
+    entity_cache.delete(("product", int(product_id)))
+    # Its purchases go with it through ON DELETE CASCADE
+    entity_cache.clear("purchase")
     return f"Product with ID {product_id} deleted."
 
-def delete_all_products(db: Session):
-    products = db.query(Product).all()
-
-    if not products:
+def delete_all_products(db: Session, batch_size: Optional[int] = None):
+    if not has_rows(db, Product):
         return "No products to delete."
 
-    db.query(Product).delete()
-    db.commit()
+    truncate_or_delete(db, Product, Product.product_id, batch_size, children=[(Purchase, Purchase.product_id)])
+    entity_cache.clear("product")
+    entity_cache.clear("purchase")
     return "All products deleted successfully."
 
 
@@ -211,40 +414,38 @@ def delete_all_products(db: Session):
 # 🛠️ Customer Functions
 # ------------------------------
 def create_customer(name, address, phone, contact_person, db: Session):
-    customer = Customer(name=name, address=address, phone=phone, contact_person=contact_person)
-    db.add(customer)
+    customer = insert_row(db, Customer, {"name": name, "address": address, "phone": phone, "contact_person": contact_person})
     db.commit()
-    db.refresh(customer)
-    return f"Customer created: {customer.customer_id}, {customer.name}, {customer.address}, {customer.phone}"
+    entity_cache.set(("customer", customer["customer_id"]), customer)
+    return f"Customer created: {customer['customer_id']}, {customer['name']}, {customer['address']}, {customer['phone']}"
 
 def get_customer(customer_id, db: Session):
-    customer = db.query(Customer).filter(Customer.customer_id == customer_id).first()
+    customer = get_cached(db, Customer, "customer", customer_id)
     if not customer:
         return f"Customer with ID {customer_id} not found."
-    return f"Customer: {customer.customer_id}, {customer.name}, {customer.address}, {customer.phone}"
+    return f"Customer: {customer['customer_id']}, {customer['name']}, {customer['address']}, {customer['phone']}"
 
 def get_all_customers(db: Session):
-    customers = db.query(Customer).all()
-    return [f"{customer.customer_id}: {customer.name}, {customer.address}, {customer.phone}" for customer in customers]
+    customers = db.query(Customer).order_by(Customer.customer_id).yield_per(STREAM_BATCH_SIZE)
+    return (f"{customer.customer_id}: {customer.name}, {customer.address}, {customer.phone}" for customer in customers)
 
 def delete_customer(customer_id: int, db: Session):
-    customer = db.query(Customer).filter(Customer.customer_id == customer_id).first()
-
-    if not customer:
+    if not delete_row(db, Customer, int(customer_id)):
+        db.rollback()
         return f"Customer with ID {customer_id} not found."
-
-    db.delete(customer)
     db.commit()
+    entity_cache.delete(("customer", int(customer_id)))
+    # Its purchases go with it through ON DELETE CASCADE
+    entity_cache.clear("purchase")
     return f"Customer with ID {customer_id} deleted successfully."
 
-def delete_all_customers(db: Session):
-    customers = db.query(Customer).all()
-
-    if not customers:
+def delete_all_customers(db: Session, batch_size: Optional[int] = None):
+    if not has_rows(db, Customer):
         return "No customers to delete."
 
-    db.query(Customer).delete()
-    db.commit()
+    truncate_or_delete(db, Customer, Customer.customer_id, batch_size, children=[(Purchase, Purchase.customer_id)])
+    entity_cache.clear("customer")
+    entity_cache.clear("purchase")
     return f"All customers deleted successfully."
 
 
@@ -253,55 +454,62 @@ def delete_all_customers(db: Session):
 # 🛠️ Purchase Functions
 # ------------------------------
 def create_purchase(product_id, customer_id, quantity, delivery_date, price_per_unit, db: Session):
-    product = db.query(Product).filter(Product.product_id == product_id).first()
-    customer = db.query(Customer).filter(Customer.customer_id == customer_id).first()
+    # Same format as the other CLI date/time arguments, e.g. 2025-01-15_10:00:00
+    delivery_date = to_datetime(delivery_date)
+    product = get_cached(db, Product, "product", product_id)
+    customer = get_cached(db, Customer, "customer", customer_id)
 
     if not product:
         return f"Product with ID {product_id} not found."
     if not customer:
         return f"Customer with ID {customer_id} not found."
 
-    purchase = Purchase(
-        product_id=product_id,
-        customer_id=customer_id,
-        quantity=quantity,
-        delivery_date=delivery_date,
-        price_per_unit=price_per_unit
-    )
-    db.add(purchase)
+    purchase = insert_row(db, Purchase, {
+        "product_id": product_id,
+        "customer_id": customer_id,
+        "quantity": quantity,
+        "delivery_date": delivery_date,
+        "price_per_unit": price_per_unit,
+    })
     db.commit()
-    db.refresh(purchase)
-    return f"Purchase created: {purchase.purchase_id}, Product ID: {purchase.product_id}, Customer ID: {purchase.customer_id}, Quantity: {purchase.quantity}, Delivery Date: {purchase.delivery_date}, Price per Unit: {purchase.price_per_unit}"
+    entity_cache.set(("purchase", purchase["purchase_id"]), purchase)
+    return f"Purchase created: {purchase['purchase_id']}, Product ID: {purchase['product_id']}, Customer ID: {purchase['customer_id']}, Quantity: {purchase['quantity']}, Delivery Date: {purchase['delivery_date']}, Price per Unit: {purchase['price_per_unit']}"
 
 def get_purchase(purchase_id, db: Session):
-    purchase = db.query(Purchase).filter(Purchase.purchase_id == purchase_id).first()
+    purchase = get_cached(db, Purchase, "purchase", purchase_id)
     if not purchase:
         return f"Purchase with ID {purchase_id} not found."
-    return f"Purchase: {purchase.purchase_id}, Product ID: {purchase.product_id}, Customer ID: {purchase.customer_id}, Quantity: {purchase.quantity}, Delivery Date: {purchase.delivery_date}, Price per Unit: {purchase.price_per_unit}"
+    return f"Purchase: {purchase['purchase_id']}, Product ID: {purchase['product_id']}, Customer ID: {purchase['customer_id']}, Quantity: {purchase['quantity']}, Delivery Date: {purchase['delivery_date']}, Price per Unit: {purchase['price_per_unit']}"
 
 def get_all_purchases(db: Session):
-    purchases = db.query(Purchase).all()
-    return [
+    purchases = db.query(Purchase).order_by(Purchase.purchase_id).yield_per(STREAM_BATCH_SIZE)
+    return (
         f"{purchase.purchase_id}: Product ID: {purchase.product_id}, Customer ID: {purchase.customer_id}, Quantity: {purchase.quantity}, Delivery Date: {purchase.delivery_date}, Price per Unit: {purchase.price_per_unit}"
         for purchase in purchases
-    ]
+    )
+
+# purchase details [ndjson|csv]
+def get_purchase_details(*args):
+    *args, db = args
+    export_format = args[0] if args else "ndjson"
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    return (line.rstrip("\r\n") for line in encode_rows(iter_purchase_details(db), export_format))
 
 def delete_purchase(purchase_id, db: Session):
-    purchase = db.query(Purchase).filter(Purchase.purchase_id == purchase_id).first()
-    if not purchase:
+    if not delete_row(db, Purchase, int(purchase_id)):
+        db.rollback()
         return f"Purchase with ID {purchase_id} not found."
-    db.delete(purchase)
     db.commit()
+    entity_cache.delete(("purchase", int(purchase_id)))
     return f"Purchase with ID {purchase_id} deleted."
 
-def delete_all_purchases(db: Session):
-    purchases = db.query(Purchase).all()
-
-    if not purchases:
+def delete_all_purchases(db: Session, batch_size: Optional[int] = None):
+    if not has_rows(db, Purchase):
         return "No purchases to delete."
 
-    db.query(Purchase).delete()
-    db.commit()
+    truncate_or_delete(db, Purchase, Purchase.purchase_id, batch_size)
+    entity_cache.clear("purchase")
     return f"All purchases deleted successfully."
 
 
@@ -331,8 +539,18 @@ def print_unknown():
     print("Unknown/invalid command. Available commands:")
     print("product: create, get, get-all, update, delete, delete-all, generate")
     print("customer: create, get, get-all, update, delete, delete-all, generate")
-    print("purchase: create, get, get-all, update, delete, delete-all, generate")
-    print("query: 1 (products by manufacturer), 2 (customer purchases), 3 (update prices), 4 (sales by product)")
+    print("purchase: create, get, get-all, details, update, reprice, delete, delete-all, purge-before, generate")
+    print("reprice options: --product-id N, --customer-id N, --date-from/--date-to YYYY-MM-DD, --quantity-over N, --batch-size N, --dry-run yes")
+    print("generate options: --chunk-size N, --workers N, --seed N")
+    print("export: products|customers|purchases|details <path> [--format parquet|arrow] [--date-from/--date-to YYYY-MM-DD]")
+    print("import: products|customers|purchases <path> (needs pyarrow)")
+    print("explain: all, query <name> (EXPLAIN ANALYZE of the built-in queries)")
+    print("query: 1 <manufacturer> [--unit U] (products by manufacturer), 2 <customer id> (customer purchases),")
+    print("       3 <new price> [reprice options] (update prices), 4 [<product id>] (sales by product),")
+    print("       5 <product|customer|manufacturer|unit> (top-N from the in-memory snapshot)")
+    print("query 2/4 options: --date-from/--date-to YYYY-MM-DD, --source live|olap (4 also summary)")
+    print("query 5 options: --metric total_revenue|total_quantity|purchase_count, --limit N, --date-from/--date-to,")
+    print("       --manufacturer M, --unit U")
 
 async def invoke(func, *args, **kwargs):
     if inspect.iscoroutinefunction(func):
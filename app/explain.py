@@ -0,0 +1,105 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import select, text, Select
+from sqlalchemy.orm import Session
+from session import env_bool
+from models import Product, Customer, Purchase
+from aggregates import summary_product_sales
+from export import purchase_details_statement
+from analytics import purchase_months, summary_months
+
+# EXPLAIN (ANALYZE, BUFFERS) for the queries the API and CLI run.
+# A sequential scan reading at least SEQ_SCAN_ROW_THRESHOLD rows is flagged,
+# unless the query is expected to read the whole table.
+
+SEQ_SCAN_ROW_THRESHOLD = int(os.getenv("EXPLAIN_SEQ_SCAN_ROWS", "10000"))
+
+# ANALYZE executes the queries, including full scans of purchases, so the
+# API only serves /debug/explain/ when enabled; the CLI explain command
+# always works
+EXPLAIN_ENDPOINT_ENABLED = env_bool("EXPLAIN_ENDPOINT_ENABLED", False)
+
+def builtin_queries() -> Dict[str, Tuple[Select, bool]]:
+    # name -> (statement, full scan expected)
+    month_ago = datetime.now() - timedelta(days=30)
+    return {
+        "get-product": (select(Product).where(Product.product_id == 1), False),
+        "get-customer": (select(Customer).where(Customer.customer_id == 1), False),
+        "get-purchase": (select(Purchase).where(Purchase.purchase_id == 1), False),
+        "list-purchases": (
+            select(Purchase).where(Purchase.purchase_id > 0).order_by(Purchase.purchase_id).limit(100),
+            False,
+        ),
+        "list-purchases-by-date": (
+            select(Purchase).where(Purchase.delivery_date >= month_ago).order_by(Purchase.purchase_id).limit(100),
+            False,
+        ),
+        "purchases-by-product": (select(Purchase).where(Purchase.product_id == 1), False),
+        "purchases-by-customer": (select(Purchase).where(Purchase.customer_id == 1), False),
+        "filter-products": (
+            select(Product)
+            .where(Product.manufacturer == "Elite Industries", Product.unit == "kg")
+            .order_by(Product.name, Product.product_id)
+            .limit(100),
+            False,
+        ),
+        "sorted-customers": (
+            select(Customer).order_by(Customer.name.desc(), Customer.customer_id.desc()).limit(100),
+            False,
+        ),
+        "customer-purchases-by-month": (purchase_months([Purchase.customer_id == 1], "postgresql"), False),
+        "product-sales-by-month": (summary_months(1, None, None, "postgresql"), False),
+        "group-by-product": (summary_product_sales(), True),
+        "purchase-details": (purchase_details_statement(), True),
+    }
+
+
+def _plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+def explain_statement(db: Session, name: str, statement: Select, full_scan_expected: bool = False) -> Dict[str, Any]:
+    sql = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    try:
+        plan = db.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")).scalar()[0]
+    finally:
+        db.rollback()
+
+    seq_scans = []
+    for node in _plan_nodes(plan["Plan"]):
+        if node["Node Type"] != "Seq Scan":
+            continue
+        rows_scanned = node["Actual Rows"] * node["Actual Loops"] + node.get("Rows Removed by Filter", 0)
+        seq_scans.append({
+            "table": node["Relation Name"],
+            "rows_scanned": rows_scanned,
+            "shared_blocks_read": node.get("Shared Read Blocks", 0),
+        })
+
+    flagged = not full_scan_expected and any(scan["rows_scanned"] >= SEQ_SCAN_ROW_THRESHOLD for scan in seq_scans)
+    return {
+        "query": name,
+        "planning_ms": plan["Planning Time"],
+        "execution_ms": plan["Execution Time"],
+        "seq_scans": seq_scans,
+        "flagged": flagged,
+    }
+
+def explain_queries(db: Session, name: Optional[str] = None) -> List[Dict[str, Any]]:
+    if db.get_bind().dialect.name != "postgresql":
+        raise ValueError("EXPLAIN (ANALYZE, BUFFERS) requires PostgreSQL.")
+    queries = builtin_queries()
+    if name is not None:
+        if name not in queries:
+            raise ValueError(f"Unknown query: {name}. Available: {', '.join(queries)}")
+        queries = {name: queries[name]}
+    return [explain_statement(db, query_name, *query) for query_name, query in queries.items()]
+
+def format_report(report: Dict[str, Any]) -> str:
+    status = "SEQ SCAN" if report["flagged"] else "ok"
+    line = f"[{status}] {report['query']}: planning {report['planning_ms']:.2f} ms, execution {report['execution_ms']:.2f} ms"
+    for scan in report["seq_scans"]:
+        line += f"\n    seq scan on {scan['table']}: {scan['rows_scanned']} rows, {scan['shared_blocks_read']} blocks read"
+    return line
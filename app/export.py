@@ -0,0 +1,71 @@
+import csv
+import io
+import orjson
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Sequence
+from sqlalchemy import select, Select
+from sqlalchemy.orm import Session
+from models import Product, Customer, Purchase
+
+# Streaming export of the purchase details join.
+# Rows are read through a server-side cursor in batches of STREAM_BATCH_SIZE
+# and encoded one line at a time, so memory does not grow with the table.
+
+STREAM_BATCH_SIZE = 1000
+
+DETAIL_COLUMNS = ("purchase_id", "product_name", "customer_name", "quantity", "delivery_date", "price_per_unit")
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def purchase_details_statement() -> Select:
+    return (
+        select(
+            Purchase.purchase_id,
+            Product.name.label("product_name"),
+            Customer.name.label("customer_name"),
+            Purchase.quantity,
+            Purchase.delivery_date,
+            Purchase.price_per_unit,
+        )
+        .join(Product, Purchase.product_id == Product.product_id)
+        .join(Customer, Purchase.customer_id == Customer.customer_id)
+    )
+
+def iter_purchase_details(db: Session, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    statement = purchase_details_statement().execution_options(yield_per=batch_size)
+    for row in db.execute(statement).mappings():
+        yield dict(row)
+
+
+# orjson encodes datetimes as ISO 8601 itself
+def ndjson_line(row: Dict[str, Any]) -> str:
+    return orjson.dumps(dict(row)).decode() + "\n"
+
+def csv_line(values: Sequence[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+def encode_rows(rows: Iterable[Dict[str, Any]], export_format: str, columns: Sequence[str] = DETAIL_COLUMNS) -> Iterator[str]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    if export_format == "csv":
+        yield csv_line(columns)
+    for row in rows:
+        if export_format == "csv":
+            yield csv_line([row[column] for column in columns])
+        else:
+            yield ndjson_line(row)
+
+async def aencode_rows(rows: AsyncIterable[Dict[str, Any]], export_format: str, columns: Sequence[str] = DETAIL_COLUMNS) -> AsyncIterator[str]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    if export_format == "csv":
+        yield csv_line(columns)
+    async for row in rows:
+        if export_format == "csv":
+            yield csv_line([row[column] for column in columns])
+        else:
+            yield ndjson_line(row)
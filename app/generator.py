@@ -0,0 +1,300 @@
+import csv
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import insert, select, Table
+from sqlalchemy.orm import Session
+
+from models import Product, Customer, Purchase
+
+# Synthetic data: random values, built column-wise with NumPy and written
+# through COPY. Nothing here touches the schema, so it is what the spawned
+# workers of generate_parallel import.
+
+# Rows are generated and written in chunks of this size, so memory stays flat
+# regardless of how many rows are requested
+DEFAULT_CHUNK_SIZE = 10000
+
+# Value pools for the random data generators
+
+PREFIXES = ["Tech", "Global", "Super", "Mega", "Pro", "Smart", "Elite", "Prime", "First", "Best"]
+SUFFIXES = ["Corp", "Systems", "Solutions", "Industries", "Group", "Partners", "International", "Ltd", "Inc", "Co"]
+MANUFACTURERS = [
+    "TechPro Manufacturing",
+    "GlobalTech Industries",
+    "Innovative Solutions",
+    "Quality Producers",
+    "Premium Products",
+    "Standard Manufacturing",
+    "Elite Industries",
+    "Professional Products",
+    "Advanced Systems",
+    "Core Manufacturing"
+]
+UNITS = ["piece", "kg", "liter", "meter", "set", "box", "pack", "ton", "pair", "bundle"]
+PRODUCT_NAMES = [
+    "Laptop Computer",
+    "Office Chair",
+    "Desk Lamp",
+    "Printer Paper",
+    "Coffee Maker",
+    "Filing Cabinet",
+    "Whiteboard",
+    "Phone Charger",
+    "USB Drive",
+    "Wireless Mouse"
+]
+STREETS = ["Main", "Park", "Lake", "Hill", "Forest", "River", "Mountain", "Valley", "Spring", "Meadow"]
+CITIES = ["Moscow", "Saint Petersburg", "Novosibirsk", "Yekaterinburg", "Kazan", "Nizhny Novgorod", "Samara"]
+FIRST_NAMES = ["Ivan", "Alexander", "Dmitry", "Mikhail", "Sergey", "Anna", "Elena", "Maria", "Olga", "Natalia"]
+LAST_NAMES = ["Ivanov", "Petrov", "Sidorov", "Smirnov", "Kuznetsov", "Popov", "Sokolov", "Lebedev", "Kozlov"]
+
+# Functions for generating random data: each call returns a whole column
+# of n values as a NumPy array, drawn from a numpy.random.Generator
+
+def _concat(*parts) -> np.ndarray:
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.char.add(result, part)
+    return result
+
+def get_random_company_names(n: int, rng: np.random.Generator) -> np.ndarray:
+    return _concat(rng.choice(PREFIXES, n), " ", rng.choice(SUFFIXES, n))
+
+def get_random_manufacturers(n: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.choice(MANUFACTURERS, n)
+
+def get_random_units(n: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.choice(UNITS, n)
+
+def get_random_product_names(n: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.choice(PRODUCT_NAMES, n)
+
+def get_random_phones(n: int, rng: np.random.Generator) -> np.ndarray:
+    codes = rng.integers(900, 1000, n).astype(str)
+    numbers = rng.integers(1000000, 10000000, n).astype(str)
+    return _concat("+7(", codes, ")", numbers)
+
+def get_random_addresses(n: int, rng: np.random.Generator) -> np.ndarray:
+    houses = rng.integers(1, 101, n).astype(str)
+    return _concat(houses, " ", rng.choice(STREETS, n), " St., ", rng.choice(CITIES, n))
+
+def get_random_person_names(n: int, rng: np.random.Generator) -> np.ndarray:
+    return _concat(rng.choice(FIRST_NAMES, n), " ", rng.choice(LAST_NAMES, n))
+
+def get_random_quantities(n: int, rng: np.random.Generator) -> np.ndarray:
+    return np.round(rng.uniform(1, 1000, n), 2)
+
+def get_random_prices(n: int, rng: np.random.Generator) -> np.ndarray:
+    return np.round(rng.uniform(10, 10000, n), 2)
+
+def get_random_dates(n: int, rng: np.random.Generator, start_date: datetime = None, now: datetime = None) -> np.ndarray:
+    if now is None:
+        now = datetime.now()
+    if start_date is None:
+        start_date = now - timedelta(days=365)
+    max_days = (now + timedelta(days=30) - start_date).days
+    days_to_add = rng.integers(0, max_days + 1, n).astype("timedelta64[D]")
+    return np.datetime64(start_date, "s") + days_to_add
+
+
+# Bulk loading helpers
+
+def iter_chunks(count: int, chunk_size: int) -> Iterator[int]:
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive.")
+    remaining = count
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        yield size
+        remaining -= size
+
+def _copy_from(db: Session, table: Table, columns: Sequence[str], buffer: io.StringIO, options: str = ""):
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN {options}".rstrip(), buffer)
+    finally:
+        cursor.close()
+
+def copy_rows(db: Session, table: Table, columns: Sequence[str], rows: List[Tuple]):
+    # PostgreSQL gets the rows streamed through COPY FROM STDIN, other backends
+    # fall back to a single executemany INSERT per chunk
+    if db.get_bind().dialect.name != "postgresql":
+        db.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+        return
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    _copy_from(db, table, columns, buffer, "WITH (FORMAT csv)")
+
+def copy_columns(db: Session, table: Table, columns: Dict[str, np.ndarray]):
+    # Same as copy_rows for column arrays. The COPY text buffer is assembled
+    # column-wise, the generated values never contain tabs or newlines
+    if db.get_bind().dialect.name != "postgresql":
+        names = list(columns)
+        values = [column.tolist() for column in columns.values()]
+        db.execute(insert(table), [dict(zip(names, row)) for row in zip(*values)])
+        return
+
+    formatted = []
+    for column in columns.values():
+        if column.dtype.kind == "f":
+            formatted.append(np.char.mod("%.2f", column))
+        else:
+            formatted.append(column.astype(str))
+    lines = _concat(*[part for column in formatted for part in ("\t", column)][1:])
+    buffer = io.StringIO("\n".join(lines.tolist()) + "\n")
+    _copy_from(db, table, list(columns), buffer)
+
+
+def generate_random_products(count: int, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE, rng: np.random.Generator = None, on_chunk: Callable[[int], None] = None):
+    rng = rng or np.random.default_rng()
+    for size in iter_chunks(count, chunk_size):
+        copy_columns(db, Product.__table__, {
+            "name": get_random_product_names(size, rng),
+            "manufacturer": get_random_manufacturers(size, rng),
+            "unit": get_random_units(size, rng),
+        })
+        if on_chunk:
+            on_chunk(size)
+
+    db.commit()
+    return f"{count} random products generated successfully."
+
+
+def generate_random_customers(count: int, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE, rng: np.random.Generator = None, on_chunk: Callable[[int], None] = None):
+    rng = rng or np.random.default_rng()
+    for size in iter_chunks(count, chunk_size):
+        copy_columns(db, Customer.__table__, {
+            "name": get_random_person_names(size, rng),
+            "address": get_random_addresses(size, rng),
+            "phone": get_random_phones(size, rng),
+            "contact_person": get_random_person_names(size, rng),
+        })
+        if on_chunk:
+            on_chunk(size)
+
+    db.commit()
+    return f"{count} random customers generated successfully."
+
+
+def generate_random_purchases(count: int, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE, rng: np.random.Generator = None, on_chunk: Callable[[int], None] = None, now: datetime = None):
+    rng = rng or np.random.default_rng()
+    # Only the id columns are needed to pick random references. They are
+    # ordered so that a seeded rng picks the same references on every run
+    product_ids = np.fromiter(db.scalars(select(Product.product_id).order_by(Product.product_id)), dtype=np.int64)
+    customer_ids = np.fromiter(db.scalars(select(Customer.customer_id).order_by(Customer.customer_id)), dtype=np.int64)
+
+    if not product_ids.size or not customer_ids.size:
+        return "Error: There must be at least one product and one customer in the database to generate purchases."
+
+    # Delivery dates are spread relative to one fixed "now" per run
+    if now is None:
+        now = datetime.now().replace(microsecond=0)
+    for size in iter_chunks(count, chunk_size):
+        copy_columns(db, Purchase.__table__, {
+            "product_id": rng.choice(product_ids, size),
+            "customer_id": rng.choice(customer_ids, size),
+            "quantity": get_random_quantities(size, rng),
+            "delivery_date": get_random_dates(size, rng, now=now),
+            "price_per_unit": get_random_prices(size, rng),
+        })
+        if on_chunk:
+            on_chunk(size)
+
+    db.commit()
+    return f"{count} random purchases generated successfully."
+
+
+GENERATORS = {
+    "product": generate_random_products,
+    "customer": generate_random_customers,
+    "purchase": generate_random_purchases,
+}
+
+
+# Parallel synthetic data generation.
+# Each worker process opens its own database connection, derives its own seed
+# from the run seed and writes a disjoint share of the rows, so a run with the
+# same seed and worker count always produces the same data.
+
+def worker_rng(seed: int, worker_index: int) -> np.random.Generator:
+    # Same stream as SeedSequence(seed).spawn(workers)[worker_index]
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(worker_index,)))
+
+def split_count(count: int, workers: int) -> List[int]:
+    base, extra = divmod(count, workers)
+    return [base + (1 if i < extra else 0) for i in range(workers)]
+
+
+def _generate_share(entity: str, worker_index: int, count: int, seed: int, chunk_size: int, now: datetime):
+    # Imported here so the engine is created inside the worker process
+    from session import SessionLocal
+
+    rng = worker_rng(seed, worker_index)
+    started = time.perf_counter()
+    done = 0
+
+    def report(size: int):
+        nonlocal done
+        done += size
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0.0
+        print(f"[worker {worker_index}] {done}/{count} rows, {rate:,.0f} rows/s", flush=True)
+
+    kwargs = {"chunk_size": chunk_size, "rng": rng, "on_chunk": report}
+    if entity == "purchase":
+        kwargs["now"] = now
+
+    with SessionLocal() as db:
+        message = GENERATORS[entity](count, db, **kwargs)
+    return worker_index, done, time.perf_counter() - started, message
+
+
+def generate_parallel(
+    entity: str,
+    count: int,
+    workers: int = 1,
+    seed: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    now: Optional[datetime] = None,
+):
+    if workers < 1:
+        raise ValueError("Number of workers must be at least 1.")
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    if now is None:
+        # Dates only depend on the seed and the day the run happens
+        now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    shares = split_count(count, workers)
+    started = time.perf_counter()
+    total = 0
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(_generate_share, entity, index, share, seed, chunk_size, now)
+            for index, share in enumerate(shares)
+            if share > 0
+        ]
+        for future in as_completed(futures):
+            worker_index, done, elapsed, message = future.result()
+            if message.startswith("Error"):
+                return message
+            total += done
+            rate = done / elapsed if elapsed else 0.0
+            print(f"[worker {worker_index}] finished {done} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)", flush=True)
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0.0
+    return (
+        f"{total} random {entity}s generated successfully by {workers} workers "
+        f"in {elapsed:.1f}s ({rate:,.0f} rows/s, seed {seed})."
+    )
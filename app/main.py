@@ -1,21 +1,70 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from api import app as api_app
-from session import get_db
+from session import SessionLocal, pool_status
+from cache import entity_cache
+from metrics import MetricsMiddleware, metrics_payload, compiled_cache_stats
+from querybudget import QueryBudgetMiddleware, track_queries, budget_of
 from data import parse_command, print_unknown, invoke
+from batch import CLI_TRANSACTION_SIZE, CLI_READ_CONCURRENCY, result_lines, run_script
+from olap import OLAP_ENABLED, olap_snapshot, refresh_forever
+import argparse
 import asyncio
 import json
 import datetime
 import inspect
+import sys
+from contextlib import asynccontextmanager
 
-from session import engine
-from models import Base
-
-# Create all tables
-Base.metadata.create_all(bind=engine)
+from session import engine, async_engine
+from schema import setup_database
 
 # Create main FastAPI application
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup runs when the app or the CLI starts, not on import: the
+    # spawned workers of "generate --workers" import this module as
+    # __mp_main__ and must not run DDL again
+    setup_database(engine)
+    # Loads the in-memory analytics snapshot and keeps it fresh
+    refresher = asyncio.create_task(refresh_forever()) if OLAP_ENABLED else None
+    yield
+    if refresher is not None:
+        refresher.cancel()
+    # Pooled asyncpg connections belong to this event loop
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+# Latency, SQL and pool wait per route for both apps, see /metrics
+app.add_middleware(MetricsMiddleware)
+# Query budget and N+1 checks, only active with QUERY_BUDGET_MODE=warn|raise
+app.add_middleware(QueryBudgetMiddleware)
+
+# Connection pool usage, to size DB_POOL_SIZE / DB_MAX_OVERFLOW under load
+@app.get("/pool/stats")
+def get_pool_stats():
+    return pool_status()
+
+# Hit/miss/eviction counters of the entity cache
+@app.get("/cache/stats")
+def get_cache_stats():
+    return entity_cache.stats()
+
+# Hit rate and size of the engines' compiled SQL caches
+@app.get("/cache/compiled")
+def get_compiled_cache_stats():
+    return compiled_cache_stats()
+
+# Size, age and refresh time of the in-memory analytics snapshot
+@app.get("/olap/stats")
+def get_olap_stats():
+    return olap_snapshot.stats()
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+def get_metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
 
 # Include the API app from api_update.py
 app.mount("/api", api_app)
@@ -28,13 +77,17 @@ def to_datetime(input_str: str) -> datetime:
 
 # Command line interface to interact with the system
 async def handle_command(command: str):
-    db = next(get_db())  # Get the database session
     parsed = parse_command(command)
 
     if not parsed["valid"]:
         print_unknown()
         return
 
+    # One session per command, returned to the pool when the command is done
+    with SessionLocal() as db, track_queries(command, budget_of(parsed["method"])):
+        await run_command(parsed, db)
+
+async def run_command(parsed, db):
     try:
         # Get the method and arguments from the parsed command
         method = parsed["method"]
@@ -46,23 +99,35 @@ async def handle_command(command: str):
         else:
             result = method(*args, db)
 
-        # Print the result
-        if result:
-            if isinstance(result, list):
-                # If the result is a list, print each item on a new line
-                for item in result:
-                    print(item)
-            else:
-                # Otherwise, print the result directly
-                print(result)
-        else:
-            print("No result found.")
+        # Print the result, lists and streamed results one item per line
+        # as they arrive
+        for line in result_lines(result):
+            print(line)
 
     except Exception as e:
+        db.rollback()
         print(f"Error executing command: {str(e)}")
 
 
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description="Sales office command line interface")
+    parser.add_argument("--script", help="Run the commands in this file, one per line, and exit")
+    parser.add_argument("--transaction-size", type=int, default=CLI_TRANSACTION_SIZE,
+                        help="Consecutive writes committed together in batch mode")
+    parser.add_argument("--concurrency", type=int, default=CLI_READ_CONCURRENCY,
+                        help="Reads run at the same time in batch mode")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    options = parse_cli_args()
+    setup_database(engine)
+    # Batch mode for a script file or commands piped into stdin
+    if options.script or not sys.stdin.isatty():
+        with (open(options.script) if options.script else sys.stdin) as script:
+            summary = asyncio.run(run_script(script, options.transaction_size, options.concurrency))
+        sys.exit(1 if summary.errors else 0)
+
     print("Command Line Interface Active. Type 'exit' to quit.")
     while (command := input("Enter command: ")) != "exit":
         asyncio.run(handle_command(command))
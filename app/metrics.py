@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CacheStats
+from session import env_bool, env_float, engine, async_engine, sync_pool_stats, async_pool_stats
+
+# Request and SQL instrumentation exported in the Prometheus text format.
+# A pure ASGI middleware times every request and keeps a RequestStats in a
+# context variable; cursor execute hooks on both engines and the pool
+# checkout timer add to it, so each request knows how much of its latency
+# went to waiting for a connection and to SQL. What is left is Python time:
+# ORM hydration and response serialization. The split is also sent back in
+# a Server-Timing header. Counters are per process, with several uvicorn
+# workers every worker exposes its own.
+# Every statement also counts as a hit or miss of the engine's compiled
+# cache, from SQLAlchemy's own execution context. A low hit rate means
+# statements are built with a different structure on every call, or that
+# DB_QUERY_CACHE_SIZE is too small for the statements in use.
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+# Statements slower than this are logged, 0 turns the log off
+SLOW_QUERY_MS = env_float("SLOW_QUERY_MS", 0)
+
+slow_query_log = logging.getLogger("sales.slow_query")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "http_request_sql_seconds", "Time spent executing SQL per request", ["route"], buckets=LATENCY_BUCKETS
+)
+REQUEST_POOL_WAIT_SECONDS = Histogram(
+    "http_request_pool_wait_seconds", "Time spent waiting for a pooled connection per request", ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SQL_QUERIES = Histogram(
+    "http_request_sql_queries", "SQL statements executed per request", ["route"], buckets=COUNT_BUCKETS
+)
+REQUEST_SQL_ROWS = Histogram(
+    "http_request_sql_rows", "Rows returned or affected by SQL per request", ["route"], buckets=ROW_BUCKETS
+)
+SQL_SECONDS = Histogram("db_query_duration_seconds", "SQL statement latency", ["engine"], buckets=LATENCY_BUCKETS)
+SQL_ROWS = Counter("db_query_rows_total", "Rows returned or affected by SQL statements", ["engine"])
+SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ["engine"])
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection", ["engine"], buckets=LATENCY_BUCKETS
+)
+COMPILED_CACHE = Counter("db_compiled_cache_total", "Statements by compiled cache outcome", ["engine", "result"])
+
+CACHE_RESULTS = {
+    CacheStats.CACHE_HIT: "hit",
+    CacheStats.CACHE_MISS: "miss",
+    CacheStats.CACHING_DISABLED: "disabled",
+    CacheStats.NO_CACHE_KEY: "no_cache_key",
+    CacheStats.NO_DIALECT_SUPPORT: "no_dialect_support",
+}
+
+class CompiledCacheStats:
+    def __init__(self, sync_engine: Engine):
+        self.engine = sync_engine
+        self._lock = threading.Lock()
+        self.counts = {result: 0 for result in CACHE_RESULTS.values()}
+
+    def record(self, result: str):
+        with self._lock:
+            self.counts[result] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        looked_up = counts["hit"] + counts["miss"]
+        cache = self.engine._compiled_cache
+        return {
+            **counts,
+            "hit_rate": counts["hit"] / looked_up if looked_up else None,
+            "entries": len(cache) if cache is not None else 0,
+            "capacity": cache.capacity if cache is not None else 0,
+        }
+
+compiled_cache = {"sync": CompiledCacheStats(engine), "async": CompiledCacheStats(async_engine.sync_engine)}
+
+def compiled_cache_stats() -> Dict[str, Any]:
+    return {name: stats.as_dict() for name, stats in compiled_cache.items()}
+
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds", "rows", "pool_wait_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_stats", default=None)
+
+
+# SQLAlchemy hooks
+
+# The start time lives on the execution context, which is discarded with
+# the statement, so a statement that raises leaves nothing behind
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(name: str):
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        # -1 when the driver doesn't know, e.g. server side cursors
+        rows = max(cursor.rowcount, 0)
+        SQL_SECONDS.labels(name).observe(elapsed)
+        SQL_ROWS.labels(name).inc(rows)
+        cache_result = CACHE_RESULTS[getattr(context, "cache_hit", CacheStats.NO_CACHE_KEY)]
+        COMPILED_CACHE.labels(name, cache_result).inc()
+        compiled_cache[name].record(cache_result)
+
+        stats = current_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_seconds += elapsed
+            stats.rows += rows
+
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            SLOW_QUERIES.labels(name).inc()
+            slow_query_log.warning("%.1f ms (%s, %d rows): %s", elapsed * 1000, name, rows, " ".join(statement.split()))
+    return after_cursor_execute
+
+def _record_pool_wait(name: str):
+    def record_pool_wait(seconds: float):
+        POOL_WAIT_SECONDS.labels(name).observe(seconds)
+        stats = current_stats.get()
+        if stats is not None:
+            stats.pool_wait_seconds += seconds
+    return record_pool_wait
+
+def instrument_engine(sync_engine: Engine, name: str, pool_stats):
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute(name))
+    pool_stats.listeners.append(_record_pool_wait(name))
+
+if METRICS_ENABLED:
+    instrument_engine(engine, "sync", sync_pool_stats)
+    instrument_engine(async_engine.sync_engine, "async", async_pool_stats)
+
+
+# Request middleware
+
+def route_label(scope) -> str:
+    # The matched route template keeps the label set bounded, the mount
+    # prefix of the API app is in root_path
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "unmatched"
+    return scope.get("root_path", "") + path
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started
+                app_seconds = max(elapsed - stats.sql_seconds - stats.pool_wait_seconds, 0.0)
+                timing = (
+                    f"pool;dur={stats.pool_wait_seconds * 1000:.1f}, db;dur={stats.sql_seconds * 1000:.1f}, "
+                    f"app;dur={app_seconds * 1000:.1f}"
+                )
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+            route = route_label(scope)
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
+            REQUEST_SQL_SECONDS.labels(route).observe(stats.sql_seconds)
+            REQUEST_POOL_WAIT_SECONDS.labels(route).observe(stats.pool_wait_seconds)
+            REQUEST_SQL_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_SQL_ROWS.labels(route).observe(stats.rows)
+
+def metrics_payload():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,9 +1,23 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey
+import os
+from sqlalchemy import Column, String, Integer, BigInteger, Float, Date, DateTime, ForeignKey, Index, FetchedValue, func
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
 
-class Product(Base):
+# Range-partition purchases by month of delivery_date (PostgreSQL only),
+# partitions are managed by partitions.py
+PURCHASES_PARTITIONED = os.getenv("PURCHASES_PARTITIONED", "false").lower() in ("1", "true", "yes", "on")
+
+# Change feed columns. On PostgreSQL every insert and update stamps the row
+# with the next value of the shared change_seq sequence and the id of the
+# writing transaction, see CHANGE_FEED_FUNCTIONS below and changes.py
+class ChangeTracked:
+    # FetchedValue: filled in by the database, never sent by the ORM
+    change_seq = Column(BigInteger, server_default=FetchedValue(), server_onupdate=FetchedValue())
+    change_xid = Column(BigInteger, server_default=FetchedValue(), server_onupdate=FetchedValue())
+    updated_at = Column(DateTime, server_default=func.now(), server_onupdate=FetchedValue())
+
+class Product(ChangeTracked, Base):
     __tablename__ = 'products'
 
     product_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -11,28 +25,264 @@ class Product(Base):
     manufacturer = Column(String(100), nullable=False)
     unit = Column(String(50), nullable=False)
 
-    purchases = relationship("Purchase", back_populates="product")
+    # Purchases are removed by ON DELETE CASCADE, not loaded and deleted by the ORM
+    purchases = relationship("Purchase", back_populates="product", passive_deletes=True)
+
+    __table_args__ = (
+        # /products/filter/, one index per sort order so a page is a range
+        # scan over (manufacturer, unit, sort key, id)
+        Index("ix_products_manufacturer_unit_product_id", "manufacturer", "unit", "product_id"),
+        Index("ix_products_manufacturer_unit_name", "manufacturer", "unit", "name", "product_id"),
+        Index("ix_products_change", "change_xid", "change_seq"),
+    )
 
-class Customer(Base):
+class Customer(ChangeTracked, Base):
     __tablename__ = 'customers'
 
     customer_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    name = Column(String(100), index=True, nullable=False)
+    name = Column(String(100), nullable=False)
     address = Column(String(200), nullable=False)
     phone = Column(String(50), nullable=False)
     contact_person = Column(String(100), nullable=False)
 
-    purchases = relationship("Purchase", back_populates="customer")
+    purchases = relationship("Purchase", back_populates="customer", passive_deletes=True)
+
+    __table_args__ = (
+        # /customers/sorted/ pages by (sort key, id), forwards or backwards
+        Index("ix_customers_name_customer_id", "name", "customer_id"),
+        Index("ix_customers_address_customer_id", "address", "customer_id"),
+        Index("ix_customers_phone_customer_id", "phone", "customer_id"),
+        Index("ix_customers_change", "change_xid", "change_seq"),
+    )
 
-class Purchase(Base):
+class Purchase(ChangeTracked, Base):
     __tablename__ = 'purchases'
 
     purchase_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    product_id = Column(Integer, ForeignKey('products.product_id'), nullable=False)
-    customer_id = Column(Integer, ForeignKey('customers.customer_id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.product_id', ondelete='CASCADE'), nullable=False)
+    customer_id = Column(Integer, ForeignKey('customers.customer_id', ondelete='CASCADE'), nullable=False)
     quantity = Column(Float, nullable=False)
-    delivery_date = Column(DateTime, nullable=False)
+    # A partitioned table needs the partition key in its primary key
+    delivery_date = Column(DateTime, nullable=False, primary_key=PURCHASES_PARTITIONED)
     price_per_unit = Column(Float, nullable=False)
 
     product = relationship("Product", back_populates="purchases")
     customer = relationship("Customer", back_populates="purchases")
+
+    __table_args__ = (
+        # Joins and foreign key checks on product/customer, optionally
+        # narrowed down by delivery date. The included columns cover the
+        # per-customer and per-product analytics, so those aggregate with
+        # index-only scans on PostgreSQL
+        Index(
+            "ix_purchases_product_id_delivery_date", "product_id", "delivery_date",
+            postgresql_include=["quantity", "price_per_unit"],
+        ),
+        Index(
+            "ix_purchases_customer_id_delivery_date", "customer_id", "delivery_date",
+            postgresql_include=["quantity", "price_per_unit"],
+        ),
+        Index("ix_purchases_delivery_date", "delivery_date"),
+        Index("ix_purchases_change", "change_xid", "change_seq"),
+        {"postgresql_partition_by": "RANGE (delivery_date)"} if PURCHASES_PARTITIONED else {},
+    )
+
+    # Rows are still identified by purchase_id alone in the ORM
+    __mapper_args__ = {"primary_key": [purchase_id]}
+
+
+# One-time migrations applied by schema.py, see MIGRATIONS there
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    name = Column(String(100), primary_key=True)
+    applied_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+# Pre-aggregated sales per product and per product and day. On PostgreSQL
+# both are kept up to date by statement-level triggers on purchases, see
+# SALES_SUMMARY_TRIGGERS below
+class ProductSales(Base):
+    __tablename__ = 'product_sales'
+
+    product_id = Column(Integer, primary_key=True)
+    total_quantity = Column(Float, nullable=False, default=0)
+    total_revenue = Column(Float, nullable=False, default=0)
+    purchase_count = Column(BigInteger, nullable=False, default=0)
+
+class ProductDailySales(Base):
+    __tablename__ = 'product_daily_sales'
+
+    product_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_quantity = Column(Float, nullable=False, default=0)
+    total_revenue = Column(Float, nullable=False, default=0)
+    purchase_count = Column(BigInteger, nullable=False, default=0)
+
+
+# The triggers see all rows touched by one statement through transition
+# tables and apply one grouped delta per statement, so COPY and bulk inserts
+# cost one upsert per product rather than one per row. Rows are upserted in
+# product order to keep lock order stable between concurrent writers
+SALES_SUMMARY_FUNCTION = """
+CREATE OR REPLACE FUNCTION purchases_sales_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO product_sales AS s (product_id, total_quantity, total_revenue, purchase_count)
+        SELECT product_id, -SUM(quantity), -SUM(quantity * price_per_unit), -COUNT(*)
+        FROM old_rows GROUP BY product_id ORDER BY product_id
+        ON CONFLICT (product_id) DO UPDATE SET
+            total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+            total_revenue = s.total_revenue + EXCLUDED.total_revenue,
+            purchase_count = s.purchase_count + EXCLUDED.purchase_count;
+
+        INSERT INTO product_daily_sales AS s (product_id, day, total_quantity, total_revenue, purchase_count)
+        SELECT product_id, delivery_date::date, -SUM(quantity), -SUM(quantity * price_per_unit), -COUNT(*)
+        FROM old_rows GROUP BY product_id, delivery_date::date ORDER BY 1, 2
+        ON CONFLICT (product_id, day) DO UPDATE SET
+            total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+            total_revenue = s.total_revenue + EXCLUDED.total_revenue,
+            purchase_count = s.purchase_count + EXCLUDED.purchase_count;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO product_sales AS s (product_id, total_quantity, total_revenue, purchase_count)
+        SELECT product_id, SUM(quantity), SUM(quantity * price_per_unit), COUNT(*)
+        FROM new_rows GROUP BY product_id ORDER BY product_id
+        ON CONFLICT (product_id) DO UPDATE SET
+            total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+            total_revenue = s.total_revenue + EXCLUDED.total_revenue,
+            purchase_count = s.purchase_count + EXCLUDED.purchase_count;
+
+        INSERT INTO product_daily_sales AS s (product_id, day, total_quantity, total_revenue, purchase_count)
+        SELECT product_id, delivery_date::date, SUM(quantity), SUM(quantity * price_per_unit), COUNT(*)
+        FROM new_rows GROUP BY product_id, delivery_date::date ORDER BY 1, 2
+        ON CONFLICT (product_id, day) DO UPDATE SET
+            total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+            total_revenue = s.total_revenue + EXCLUDED.total_revenue,
+            purchase_count = s.purchase_count + EXCLUDED.purchase_count;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SALES_SUMMARY_TRUNCATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION purchases_sales_summary_truncate() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE product_sales, product_daily_sales;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SALES_SUMMARY_TRIGGERS = [
+    SALES_SUMMARY_FUNCTION,
+    SALES_SUMMARY_TRUNCATE_FUNCTION,
+    "DROP TRIGGER IF EXISTS purchases_sales_insert ON purchases",
+    "CREATE TRIGGER purchases_sales_insert AFTER INSERT ON purchases "
+    "REFERENCING NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION purchases_sales_summary()",
+    "DROP TRIGGER IF EXISTS purchases_sales_update ON purchases",
+    "CREATE TRIGGER purchases_sales_update AFTER UPDATE ON purchases "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION purchases_sales_summary()",
+    "DROP TRIGGER IF EXISTS purchases_sales_delete ON purchases",
+    "CREATE TRIGGER purchases_sales_delete AFTER DELETE ON purchases "
+    "REFERENCING OLD TABLE AS old_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION purchases_sales_summary()",
+    "DROP TRIGGER IF EXISTS purchases_sales_truncate ON purchases",
+    "CREATE TRIGGER purchases_sales_truncate AFTER TRUNCATE ON purchases "
+    "FOR EACH STATEMENT EXECUTE FUNCTION purchases_sales_summary_truncate()",
+]
+
+# Installed once by the sales_summary_triggers migration in schema.py
+
+
+# Deleted rows for the change feed, entity_id is NULL when the whole table
+# was truncated
+class ChangeTombstone(Base):
+    __tablename__ = 'change_tombstones'
+
+    change_seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    change_xid = Column(BigInteger, nullable=False)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_change_tombstones_entity_change", "entity", "change_xid", "change_seq"),
+    )
+
+
+# Inserts get their change columns from column defaults and updates from a
+# row trigger. Deletes and truncates leave tombstones through statement
+# triggers. Installed once by the change_feed migration in schema.py, which
+# also brings tables created before the change feed existed up to date
+CHANGE_FEED_TABLES = [("products", "product", "product_id"), ("customers", "customer", "customer_id"), ("purchases", "purchase", "purchase_id")]
+
+CURRENT_XID = "pg_current_xact_id()::text::bigint"
+
+CHANGE_FEED_FUNCTIONS = [
+    "CREATE SEQUENCE IF NOT EXISTS change_seq",
+    """
+CREATE OR REPLACE FUNCTION record_row_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('change_seq');
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION record_row_deletes() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO change_tombstones (entity, entity_id) SELECT %%L, %%I FROM old_rows ORDER BY 2',
+        TG_ARGV[0], TG_ARGV[1]
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION record_truncate() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_tombstones (entity) VALUES (TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+    "ALTER TABLE change_tombstones ALTER COLUMN change_seq SET DEFAULT nextval('change_seq')",
+    f"ALTER TABLE change_tombstones ALTER COLUMN change_xid SET DEFAULT {CURRENT_XID}",
+]
+
+# change_seq is added without a default: a volatile default on ADD COLUMN
+# rewrites the whole table. The default only applies to new rows, existing
+# ones are numbered in batches by the migration. The constant and now()
+# defaults of the other two columns are stored once, without a rewrite
+def change_feed_columns_ddl(table: str):
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_seq BIGINT",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_xid BIGINT DEFAULT 0",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()",
+        f"ALTER TABLE {table} ALTER COLUMN change_seq SET DEFAULT nextval('change_seq')",
+        f"ALTER TABLE {table} ALTER COLUMN change_xid SET DEFAULT {CURRENT_XID}",
+    ]
+
+def change_feed_triggers_ddl(table: str, entity: str, pk: str):
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_change ON {table} (change_xid, change_seq)",
+        f"DROP TRIGGER IF EXISTS {table}_change_update ON {table}",
+        f"CREATE TRIGGER {table}_change_update BEFORE UPDATE ON {table} "
+        "FOR EACH ROW EXECUTE FUNCTION record_row_change()",
+        f"DROP TRIGGER IF EXISTS {table}_change_delete ON {table}",
+        f"CREATE TRIGGER {table}_change_delete AFTER DELETE ON {table} "
+        "REFERENCING OLD TABLE AS old_rows "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION record_row_deletes('{entity}', '{pk}')",
+        f"DROP TRIGGER IF EXISTS {table}_change_truncate ON {table}",
+        f"CREATE TRIGGER {table}_change_truncate AFTER TRUNCATE ON {table} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION record_truncate('{entity}')",
+    ]
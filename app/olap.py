@@ -0,0 +1,517 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from session import env_float, env_bool, SessionLocal
+from models import Product, Customer, Purchase, ChangeTombstone
+from analytics import build_report
+
+# In-memory column store of purchases for analytics that shouldn't scan the
+# purchases table. Purchases are kept as NumPy arrays sorted by
+# purchase_id; product and customer attributes are dictionary encoded into
+# lookup arrays indexed by id. Group-by, filter and top-N queries are
+# vectorized passes over these arrays (masks and bincount).
+# The first load on PostgreSQL reads one binary COPY straight into the
+# arrays. Later refreshes only fetch rows and tombstones written by
+# transactions that were still unfinished at the previous refresh, through
+# the change feed columns and indexes (see changes.py); the snapshot xmin
+# taken before each fetch is the watermark for the next one. Other backends
+# reload everything on refresh. Every process has its own snapshot.
+
+OLAP_ENABLED = env_bool("OLAP_ENABLED", False)
+# Seconds between refreshes, also the staleness the snapshot may have
+OLAP_REFRESH_SECONDS = env_float("OLAP_REFRESH_SECONDS", 5.0)
+# Deleted rows are dropped from the arrays once they make up this share
+OLAP_COMPACT_RATIO = 0.25
+# Bytes of COPY output parsed per block
+COPY_BLOCK_SIZE = 4 << 20
+
+olap_log = logging.getLogger("sales.olap")
+
+DIMENSIONS = ("product", "customer", "manufacturer", "unit")
+METRICS = ("total_revenue", "total_quantity", "purchase_count")
+
+PURCHASE_COLUMNS = ("purchase_id", "product_id", "customer_id", "quantity", "price_per_unit", "delivery_date")
+DTYPES = {
+    "purchase_id": np.int64,
+    "product_id": np.int64,
+    "customer_id": np.int64,
+    "quantity": np.float64,
+    "price_per_unit": np.float64,
+    "delivery_date": "datetime64[us]",
+}
+
+# Binary COPY of the purchase columns: every row has the same size since
+# none of them is nullable. Timestamps are microseconds since 2000-01-01
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+PG_ROW = np.dtype([
+    ("fields", ">i2"),
+    ("purchase_id_len", ">i4"), ("purchase_id", ">i4"),
+    ("product_id_len", ">i4"), ("product_id", ">i4"),
+    ("customer_id_len", ">i4"), ("customer_id", ">i4"),
+    ("quantity_len", ">i4"), ("quantity", ">f8"),
+    ("price_per_unit_len", ">i4"), ("price_per_unit", ">f8"),
+    ("delivery_date_len", ">i4"), ("delivery_date", ">i8"),
+])
+
+Columns = Dict[str, np.ndarray]
+
+def _binary_rows(data: bytes, rows: int) -> Columns:
+    records = np.frombuffer(data, dtype=PG_ROW, count=rows)
+    chunk = {name: records[name].astype(DTYPES[name]) for name in PURCHASE_COLUMNS if name != "delivery_date"}
+    chunk["delivery_date"] = PG_EPOCH + records["delivery_date"].astype(np.int64).astype("timedelta64[us]")
+    return chunk
+
+def _read_binary_copy(source) -> Columns:
+    header = source.read(19)
+    if not header.startswith(PG_COPY_SIGNATURE) or len(header) < 19:
+        raise ValueError("Unexpected COPY BINARY header")
+    source.read(int.from_bytes(header[15:19], "big"))
+    chunks, pending = [], b""
+    while block := source.read(COPY_BLOCK_SIZE):
+        data = pending + block
+        rows = len(data) // PG_ROW.itemsize
+        if rows:
+            chunks.append(_binary_rows(data, rows))
+        pending = data[rows * PG_ROW.itemsize:]
+    # Only the trailer, -1 as int16, may be left
+    if pending != b"\xff\xff":
+        raise ValueError("Truncated COPY BINARY stream")
+    return concat_columns(chunks)
+
+# Like columnar._copy_out_batches: psycopg2 writes every row on its own, so
+# COPY writes into a pipe from its own thread and the rows are parsed in
+# blocks on this one
+def _copy_out_columns(db: Session, statement) -> Columns:
+    cursor = db.connection().connection.cursor()
+    compiled = statement.compile(dialect=db.get_bind().dialect)
+    query = cursor.mogrify(str(compiled), compiled.params).decode()
+
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        with open(write_fd, "wb") as sink:
+            try:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", sink)
+            except Exception as err:
+                errors.append(err)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        with open(read_fd, "rb") as source:
+            columns = _read_binary_copy(source)
+    except ValueError:
+        # A failed COPY leaves a truncated stream, report the database error
+        if not errors:
+            raise
+    finally:
+        producer.join()
+        cursor.close()
+    if errors:
+        raise errors[0]
+    return columns
+
+def empty_columns() -> Columns:
+    return {name: np.empty(0, dtype=DTYPES[name]) for name in PURCHASE_COLUMNS}
+
+def concat_columns(chunks: List[Columns]) -> Columns:
+    if not chunks:
+        return empty_columns()
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in PURCHASE_COLUMNS}
+
+def fetch_purchases(db: Session, since_xid: Optional[int] = None) -> Columns:
+    columns = [getattr(Purchase, name) for name in PURCHASE_COLUMNS]
+    statement = select(*columns)
+    if since_xid is not None:
+        statement = statement.where(Purchase.change_xid >= since_xid)
+
+    if db.get_bind().dialect.name == "postgresql":
+        return _copy_out_columns(db, statement)
+
+    chunks = []
+    for rows in db.execute(statement.execution_options(yield_per=100000)).partitions():
+        values = list(zip(*rows))
+        chunks.append({name: np.array(values[i], dtype=DTYPES[name]) for i, name in enumerate(PURCHASE_COLUMNS)})
+    return concat_columns(chunks)
+
+def encode(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # Dictionary encoding: sorted distinct values and one code per value
+    if not values:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int32)
+    categories, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    return categories, codes.astype(np.int32)
+
+class Dimension:
+    # Attributes of products or customers as codes in arrays indexed by id,
+    # -1 where there is no such id
+    def __init__(self, ids: np.ndarray, attributes: Dict[str, List[str]]):
+        size = int(ids.max()) + 1 if ids.size else 1
+        self.categories: Dict[str, np.ndarray] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for name, values in attributes.items():
+            categories, codes = encode(values)
+            by_id = np.full(size, -1, dtype=np.int32)
+            by_id[ids] = codes
+            self.categories[name] = categories
+            self.codes[name] = by_id
+
+    def code_of(self, name: str, value: str) -> int:
+        categories = self.categories[name]
+        index = int(np.searchsorted(categories, value)) if categories.size else 0
+        return index if index < categories.size and categories[index] == value else -1
+
+    def label(self, name: str, entity_id: int) -> Optional[str]:
+        by_id = self.codes[name]
+        code = by_id[entity_id] if entity_id < by_id.size else -1
+        return self.categories[name][code] if code >= 0 else None
+
+    def lookup(self, name: str, ids: np.ndarray) -> np.ndarray:
+        by_id = self.codes[name]
+        inside = ids < by_id.size
+        codes = np.full(ids.shape, -1, dtype=np.int32)
+        codes[inside] = by_id[ids[inside]]
+        return codes
+
+def load_dimension(db: Session, model, attributes: Tuple[str, ...]) -> Dimension:
+    pk = model.__mapper__.primary_key[0]
+    rows = db.execute(select(pk, *[getattr(model, name) for name in attributes])).all()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    return Dimension(ids, {name: [row[i + 1] for row in rows] for i, name in enumerate(attributes)})
+
+class PurchaseSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.columns: Columns = empty_columns()
+        self.live = np.empty(0, dtype=bool)
+        self.size = 0
+        self.products: Optional[Dimension] = None
+        self.customers: Optional[Dimension] = None
+        # Changes of transactions below this id are in the snapshot
+        self.watermark: Optional[int] = None
+        self.refreshed_at: Optional[float] = None
+        self.refresh_seconds = 0.0
+        self.refreshes = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.refreshed_at is not None
+
+    # Loading and refreshing
+
+    def refresh(self, db: Session):
+        self.refresh_if_stale(db, 0.0)
+
+    def refresh_if_stale(self, db: Session, max_age: float = OLAP_REFRESH_SECONDS):
+        # Concurrent callers wait for one refresh instead of running their own
+        with self._refresh_lock:
+            if self.refreshed_at is not None and time.time() - self.refreshed_at < max_age:
+                return
+            started = time.perf_counter()
+            if db.get_bind().dialect.name != "postgresql" or self.watermark is None:
+                self._load(db)
+            else:
+                self._apply_changes(db)
+            db.rollback()
+            self.refresh_seconds = time.perf_counter() - started
+            self.refreshed_at = time.time()
+            self.refreshes += 1
+
+    def _xmin(self, db: Session) -> Optional[int]:
+        if db.get_bind().dialect.name != "postgresql":
+            return None
+        return db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar_one()
+
+    def _load(self, db: Session):
+        # Taken first: everything below it is visible to the reads that follow
+        watermark = self._xmin(db)
+        columns = fetch_purchases(db)
+        order = np.argsort(columns["purchase_id"], kind="stable")
+        columns = {name: values[order] for name, values in columns.items()}
+        products = load_dimension(db, Product, ("name", "manufacturer", "unit"))
+        customers = load_dimension(db, Customer, ("name",))
+        with self._lock:
+            self.columns = columns
+            self.size = len(order)
+            self.live = np.ones(self.size, dtype=bool)
+            self.products, self.customers = products, customers
+            self.watermark = watermark
+
+    def _apply_changes(self, db: Session):
+        watermark = self._xmin(db)
+        since = self.watermark
+        tombstones = db.execute(
+            select(ChangeTombstone.entity, ChangeTombstone.entity_id).where(ChangeTombstone.change_xid >= since)
+        ).all()
+        # Truncated purchases
+        if any(entity == "purchase" and entity_id is None for entity, entity_id in tombstones):
+            self._load(db)
+            return
+
+        # Products and customers are small, any change reloads them whole
+        dimensions_changed = any(entity != "purchase" for entity, _ in tombstones) or any(
+            db.execute(select(model.change_xid).where(model.change_xid >= since).limit(1)).first()
+            for model in (Product, Customer)
+        )
+        products = load_dimension(db, Product, ("name", "manufacturer", "unit")) if dimensions_changed else self.products
+        customers = load_dimension(db, Customer, ("name",)) if dimensions_changed else self.customers
+
+        changed = fetch_purchases(db, since_xid=since)
+        deleted = np.array([entity_id for entity, entity_id in tombstones if entity == "purchase"], dtype=np.int64)
+        # A deleted id that is back in the table was inserted again
+        deleted = np.setdiff1d(deleted, changed["purchase_id"])
+
+        with self._lock:
+            self._delete(deleted)
+            self._upsert(changed)
+            self.products, self.customers = products, customers
+            self.watermark = watermark
+            if self.size and 1 - self.live[:self.size].mean() > OLAP_COMPACT_RATIO:
+                self._compact()
+
+    def _find(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        existing = self.columns["purchase_id"][:self.size]
+        positions = np.searchsorted(existing, ids)
+        found = positions < self.size
+        found[found] = existing[positions[found]] == ids[found]
+        return positions, found
+
+    def _delete(self, ids: np.ndarray):
+        if not ids.size or not self.size:
+            return
+        positions, found = self._find(ids)
+        self.live[positions[found]] = False
+
+    def _upsert(self, changed: Columns):
+        ids = changed["purchase_id"]
+        if not ids.size:
+            return
+        positions, found = self._find(ids)
+        for name in PURCHASE_COLUMNS:
+            self.columns[name][positions[found]] = changed[name][found]
+        self.live[positions[found]] = True
+
+        new = ~found
+        count = int(new.sum())
+        if not count:
+            return
+        keep_sorted = self.size == 0 or ids[new].min() > self.columns["purchase_id"][self.size - 1]
+        self._reserve(self.size + count)
+        for name in PURCHASE_COLUMNS:
+            self.columns[name][self.size:self.size + count] = changed[name][new]
+        self.live[self.size:self.size + count] = True
+        self.size += count
+        if not keep_sorted or not np.all(np.diff(self.columns["purchase_id"][self.size - count - 1:self.size]) > 0):
+            self._compact()
+
+    def _reserve(self, size: int):
+        capacity = len(self.live)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        for name, values in self.columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+        live = np.zeros(capacity, dtype=bool)
+        live[:self.size] = self.live[:self.size]
+        self.live = live
+
+    def _compact(self):
+        # Drops deleted rows and restores purchase_id order
+        keep = np.flatnonzero(self.live[:self.size])
+        order = keep[np.argsort(self.columns["purchase_id"][keep], kind="stable")]
+        self.columns = {name: values[order] for name, values in self.columns.items()}
+        self.size = len(order)
+        self.live = np.ones(self.size, dtype=bool)
+
+    # Queries
+
+    def _mask(self, date_from: Optional[date], date_to: Optional[date], **equals: Optional[int]) -> np.ndarray:
+        mask = self.live[:self.size].copy()
+        delivered = self.columns["delivery_date"][:self.size]
+        if date_from is not None:
+            mask &= delivered >= np.datetime64(date_from, "us")
+        if date_to is not None:
+            # date_to is inclusive
+            mask &= delivered < np.datetime64(date_to + timedelta(days=1), "us")
+        for name, value in equals.items():
+            if value is not None:
+                mask &= self.columns[name][:self.size] == value
+        return mask
+
+    def _selected(self, mask: np.ndarray) -> Columns:
+        selected = {name: values[:self.size][mask] for name, values in self.columns.items()}
+        selected["revenue"] = selected["quantity"] * selected["price_per_unit"]
+        return selected
+
+    def _require(self):
+        if not self.ready:
+            raise RuntimeError("The OLAP snapshot is not loaded yet.")
+
+    def report(self, date_from: Optional[date], date_to: Optional[date], **equals: int) -> Dict[str, Any]:
+        # Same figures as analytics.customer_purchases / product_sales
+        self._require()
+        with self._lock:
+            rows = self._selected(self._mask(date_from, date_to, **equals))
+        delivered = rows["delivery_date"]
+        totals = {
+            **equals,
+            "purchase_count": int(delivered.size),
+            "total_quantity": float(rows["quantity"].sum()),
+            "total_revenue": float(rows["revenue"].sum()),
+            "first_delivery": delivered.min().item() if delivered.size else None,
+            "last_delivery": delivered.max().item() if delivered.size else None,
+        }
+        months, index = np.unique(delivered.astype("datetime64[M]"), return_inverse=True)
+        counts = np.bincount(index, minlength=months.size)
+        quantities = np.bincount(index, weights=rows["quantity"], minlength=months.size)
+        revenues = np.bincount(index, weights=rows["revenue"], minlength=months.size)
+        return build_report(totals, [
+            {
+                "month": month.astype("datetime64[D]").item(),
+                "purchase_count": int(count),
+                "total_quantity": float(quantity),
+                "total_revenue": float(revenue),
+            }
+            for month, count, quantity, revenue in zip(months, counts, quantities, revenues)
+        ])
+
+    def product_sales(
+        self,
+        product_id: Optional[int] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        daily: bool = False,
+    ) -> List[Dict[str, Any]]:
+        # Same rows as aggregates.live_product_sales / live_product_daily_sales
+        self._require()
+        with self._lock:
+            rows = self._selected(self._mask(date_from, date_to, product_id=product_id))
+        if daily:
+            # One int64 key per (product, day), ordered like the pair
+            days = rows["delivery_date"].astype("datetime64[D]").astype(np.int64)
+            first = int(days.min()) if days.size else 0
+            span = int(days.max()) - first + 1 if days.size else 1
+            keys, index = np.unique(rows["product_id"] * span + (days - first), return_inverse=True)
+            groups = zip(keys // span, (keys % span + first).astype("datetime64[D]"))
+            counts = np.bincount(index, minlength=len(keys))
+            quantities = np.bincount(index, weights=rows["quantity"], minlength=len(keys))
+            revenues = np.bincount(index, weights=rows["revenue"], minlength=len(keys))
+        else:
+            # Product ids are dense enough to be their own group index
+            counts = np.bincount(rows["product_id"])
+            groups = np.flatnonzero(counts)
+            quantities = np.bincount(rows["product_id"], weights=rows["quantity"])[groups]
+            revenues = np.bincount(rows["product_id"], weights=rows["revenue"])[groups]
+            counts = counts[groups]
+        result = []
+        for group, count, quantity, revenue in zip(groups, counts, quantities, revenues):
+            row = {"product_id": int(group[0]), "day": group[1].item()} if daily else {"product_id": int(group)}
+            row.update(total_quantity=float(quantity), total_revenue=float(revenue), purchase_count=int(count))
+            result.append(row)
+        return result
+
+    def top(
+        self,
+        dimension: str,
+        metric: str = "total_revenue",
+        limit: int = 10,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        manufacturer: Optional[str] = None,
+        unit: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}. Available: {', '.join(DIMENSIONS)}")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}. Available: {', '.join(METRICS)}")
+        self._require()
+        with self._lock:
+            products, customers = self.products, self.customers
+            mask = self._mask(date_from, date_to)
+            for name, value in (("manufacturer", manufacturer), ("unit", unit)):
+                if value is not None:
+                    code = products.code_of(name, value)
+                    # -1 is also the code of purchases whose product isn't
+                    # loaded, an unknown value must not match those
+                    if code < 0:
+                        return []
+                    mask &= products.lookup(name, self.columns["product_id"][:self.size]) == code
+            rows = self._selected(mask)
+
+        # Group keys are the ids of products and customers and the codes of
+        # manufacturers and units
+        if dimension in ("product", "customer"):
+            keys = rows[f"{dimension}_id"]
+        else:
+            keys = products.lookup(dimension, rows["product_id"])
+            known = keys >= 0
+            keys = keys[known]
+            rows = {name: values[known] for name, values in rows.items()}
+        counts = np.bincount(keys)
+        values = {
+            "purchase_count": counts,
+            "total_quantity": np.bincount(keys, weights=rows["quantity"]),
+            "total_revenue": np.bincount(keys, weights=rows["revenue"]),
+        }
+
+        present = np.flatnonzero(counts)
+        ranked = -values[metric][present]
+        if present.size > limit:
+            chosen = np.argpartition(ranked, limit - 1)[:limit]
+            present, ranked = present[chosen], ranked[chosen]
+        present = present[np.argsort(ranked, kind="stable")]
+
+        result = []
+        for key in present:
+            if dimension == "product":
+                row = {"product_id": int(key), "name": products.label("name", int(key))}
+            elif dimension == "customer":
+                row = {"customer_id": int(key), "name": customers.label("name", int(key))}
+            else:
+                row = {dimension: products.categories[dimension][key]}
+            row.update({name: int(values[name][key]) if name == "purchase_count" else float(values[name][key]) for name in METRICS[::-1]})
+            result.append(row)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = int(self.live[:self.size].sum())
+            memory = sum(values.nbytes for values in self.columns.values()) + self.live.nbytes
+        return {
+            "enabled": OLAP_ENABLED,
+            "ready": self.ready,
+            "rows": live,
+            "deleted_rows": self.size - live,
+            "memory_bytes": memory,
+            "watermark": self.watermark,
+            "refreshes": self.refreshes,
+            "last_refresh_seconds": round(self.refresh_seconds, 4),
+            "age_seconds": round(time.time() - self.refreshed_at, 3) if self.refreshed_at else None,
+        }
+
+olap_snapshot = PurchaseSnapshot()
+
+def refresh_snapshot(max_age: float = 0.0):
+    with SessionLocal() as db:
+        olap_snapshot.refresh_if_stale(db, max_age)
+
+# Runs for the lifetime of the API with OLAP_ENABLED, queries never wait for
+# the database. Refreshes use the sync engine on a worker thread
+async def refresh_forever():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_snapshot)
+        except Exception:
+            olap_log.exception("OLAP snapshot refresh failed")
+        await asyncio.sleep(OLAP_REFRESH_SECONDS)
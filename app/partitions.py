@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+from sqlalchemy import text, delete, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from models import Purchase, PURCHASES_PARTITIONED
+from cache import entity_cache
+
+# Monthly range partitions of purchases on delivery_date.
+# Partitions are named purchases_yYYYYmMM and cover [first of month, first of
+# next month). Rows outside the created range land in purchases_default; a
+# month can only be added later while the default partition holds no rows
+# for it, so enough months ahead should be created at startup.
+
+PARTITION_MONTHS_BACK = int(os.getenv("PARTITION_MONTHS_BACK", "12"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "10000"))
+
+PARTITION_NAME = re.compile(r"^purchases_y(\d{4})m(\d{2})$")
+
+partition_log = logging.getLogger("sales.partitions")
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"purchases_y{month.year:04d}m{month.month:02d}"
+
+def partitioning_enabled(bind) -> bool:
+    return PURCHASES_PARTITIONED and bind.dialect.name == "postgresql"
+
+
+# A new month can't be created while the default partition holds rows for
+# it, those rows have to be moved out first
+def _blocked_by_default(conn, name: str, start: date, end: date) -> bool:
+    if conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None:
+        return False
+    return conn.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM purchases_default WHERE delivery_date >= :start AND delivery_date < :end)"),
+        {"start": start, "end": end},
+    )
+
+def ensure_purchase_partitions(
+    engine: Engine,
+    months_back: int = PARTITION_MONTHS_BACK,
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+    today: Optional[date] = None,
+) -> List[str]:
+    if not partitioning_enabled(engine):
+        return []
+
+    current = (today or date.today()).replace(day=1)
+    names = []
+    with engine.begin() as conn:
+        # PURCHASES_PARTITIONED only applies when the table is first created
+        if conn.scalar(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'purchases'::regclass")) is None:
+            partition_log.warning(
+                "PURCHASES_PARTITIONED is set but purchases is not a partitioned table, no partitions created"
+            )
+            return []
+        conn.execute(text("CREATE TABLE IF NOT EXISTS purchases_default PARTITION OF purchases DEFAULT"))
+        for offset in range(-months_back, months_ahead + 1):
+            start = add_months(current, offset)
+            end = add_months(start, 1)
+            name = partition_name(start)
+            if _blocked_by_default(conn, name, start, end):
+                partition_log.warning(
+                    "purchases_default holds rows delivered in %s, partition %s not created", start.strftime("%Y-%m"), name
+                )
+                continue
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF purchases "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            names.append(name)
+    return names
+
+def list_purchase_partitions(db: Session) -> List[Tuple[str, date]]:
+    rows = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'purchases'"
+    )).scalars()
+    partitions = []
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+# Retention: removes purchases delivered before the first day of the month
+# of cutoff. Whole partitions are dropped (or truncated and kept), which
+# does not fire the row triggers, so the sales summaries and the change feed
+# tombstones are updated here
+def _subtract_from_sales_summary(db: Session, name: str, start: date, end: date):
+    db.execute(text(
+        "UPDATE product_sales AS s SET "
+        "total_quantity = s.total_quantity - d.total_quantity, "
+        "total_revenue = s.total_revenue - d.total_revenue, "
+        "purchase_count = s.purchase_count - d.purchase_count "
+        "FROM (SELECT product_id, SUM(quantity) AS total_quantity, "
+        "SUM(quantity * price_per_unit) AS total_revenue, COUNT(*) AS purchase_count "
+        f"FROM {name} GROUP BY product_id) AS d "
+        "WHERE s.product_id = d.product_id"
+    ))
+    db.execute(
+        text("DELETE FROM product_daily_sales WHERE day >= :start AND day < :end"),
+        {"start": start, "end": end},
+    )
+
+def _record_purged(db: Session, name: str):
+    db.execute(text(
+        f"INSERT INTO change_tombstones (entity, entity_id) SELECT 'purchase', purchase_id FROM {name} ORDER BY purchase_id"
+    ))
+
+# Deletes in batches so each transaction stays short, the statement triggers
+# keep the sales summaries in sync
+def _delete_before(db: Session, cutoff: date, batch_size: int) -> int:
+    deleted = 0
+    while True:
+        batch = (
+            select(Purchase.purchase_id)
+            .where(Purchase.delivery_date < cutoff)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        result = db.execute(
+            delete(Purchase).where(Purchase.delivery_date < cutoff, Purchase.purchase_id.in_(batch))
+        )
+        db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+def purge_purchases_before(db: Session, cutoff: date, mode: str = "drop", batch_size: int = RETENTION_BATCH_SIZE) -> str:
+    if mode not in ("drop", "truncate"):
+        raise ValueError("Mode must be 'drop' or 'truncate'.")
+    cutoff = cutoff.replace(day=1)
+
+    if not partitioning_enabled(db.get_bind()):
+        deleted = _delete_before(db, cutoff, batch_size)
+        entity_cache.clear("purchase")
+        return f"{deleted} purchases delivered before {cutoff} deleted."
+
+    purged = []
+    for name, start in list_purchase_partitions(db):
+        end = add_months(start, 1)
+        if end > cutoff:
+            continue
+        # Blocks writers to this month until the DROP/TRUNCATE commits, so no
+        # row can land in it after its totals were subtracted
+        db.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        _subtract_from_sales_summary(db, name, start, end)
+        _record_purged(db, name)
+        db.execute(text(f"DROP TABLE {name}" if mode == "drop" else f"TRUNCATE {name}"))
+        db.commit()
+        purged.append(name)
+
+    # Older rows that went to the default partition
+    deleted = _delete_before(db, cutoff, batch_size)
+
+    entity_cache.clear("purchase")
+    action = "dropped" if mode == "drop" else "truncated"
+    return f"Partitions {action}: {', '.join(purged) or 'none'}; {deleted} purchases deleted from the default partition."
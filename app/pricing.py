@@ -0,0 +1,128 @@
+import os
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from models import Purchase
+from cache import entity_cache
+
+# Set-based repricing of purchases.
+# A run is a COUNT of the matching rows followed by one UPDATE ... RETURNING,
+# or, with a batch size, the same pair per keyset batch of purchase ids with a
+# commit after each batch so huge runs don't hold one long transaction.
+# Rows that already have the new price are matched but not updated, which
+# keeps them out of the WAL and out of the sales summary triggers.
+
+REPRICE_BATCH_SIZE = int(os.getenv("REPRICE_BATCH_SIZE", "0"))
+
+# Same rule as the old per-row endpoint: only quantities above 10 are repriced
+DEFAULT_QUANTITY_OVER = 10
+
+def reprice_conditions(
+    product_id: Optional[int] = None,
+    customer_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    quantity_over: Optional[float] = DEFAULT_QUANTITY_OVER,
+    purchase_id: Optional[int] = None,
+) -> List[Any]:
+    conditions = []
+    if purchase_id is not None:
+        conditions.append(Purchase.purchase_id == purchase_id)
+    if product_id is not None:
+        conditions.append(Purchase.product_id == product_id)
+    if customer_id is not None:
+        conditions.append(Purchase.customer_id == customer_id)
+    if date_from is not None:
+        conditions.append(Purchase.delivery_date >= date_from)
+    if date_to is not None:
+        # delivery_date is a timestamp, so include the whole last day
+        conditions.append(Purchase.delivery_date < date_to + timedelta(days=1))
+    if quantity_over is not None:
+        conditions.append(Purchase.quantity > quantity_over)
+    return conditions
+
+def reprice_count_statement(conditions: List[Any], new_price: float, after_id: Optional[int] = None, limit: Optional[int] = None):
+    # matched, to_update and the last matching id in one round trip; with a
+    # limit only the next keyset batch after after_id is counted
+    window = select(Purchase.purchase_id, Purchase.price_per_unit).where(*conditions)
+    if limit is not None:
+        window = window.where(Purchase.purchase_id > after_id).order_by(Purchase.purchase_id).limit(limit)
+    window = window.subquery()
+    return select(
+        func.count().label("matched"),
+        func.count().filter(window.c.price_per_unit.is_distinct_from(new_price)).label("to_update"),
+        func.max(window.c.purchase_id).label("last_id"),
+    ).select_from(window)
+
+def reprice_statement(conditions: List[Any], new_price: float):
+    return (
+        update(Purchase)
+        .where(*conditions, Purchase.price_per_unit.is_distinct_from(new_price))
+        .values(price_per_unit=new_price)
+        .returning(Purchase.purchase_id)
+    )
+
+def _apply_reprice(db: Session, conditions: List[Any], new_price: float) -> List[int]:
+    return db.execute(reprice_statement(conditions, new_price)).scalars().all()
+
+def _commit_reprice(db: Session, ids: List[int], invalidate: Callable[..., Any]):
+    # Cached purchases are dropped only once the new prices are committed;
+    # dropping them earlier lets a concurrent read cache the old price again
+    db.commit()
+    invalidate(*[("purchase", purchase_id) for purchase_id in ids])
+
+def reprice_purchases(
+    db: Session,
+    new_price: float,
+    product_id: Optional[int] = None,
+    customer_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    quantity_over: Optional[float] = DEFAULT_QUANTITY_OVER,
+    purchase_id: Optional[int] = None,
+    dry_run: bool = False,
+    batch_size: int = REPRICE_BATCH_SIZE,
+    invalidate: Optional[Callable[..., Any]] = None,
+) -> Dict[str, Any]:
+    if new_price < 0:
+        raise ValueError("Price must not be negative.")
+    conditions = reprice_conditions(product_id, customer_id, date_from, date_to, quantity_over, purchase_id)
+    matched = to_update = updated = batches = 0
+    ids = []
+    # Takes the cache keys to drop, see cache.threaded_deletes for the API
+    invalidate = invalidate or entity_cache.delete
+
+    if not batch_size or batch_size < 1:
+        counts = db.execute(reprice_count_statement(conditions, new_price)).one()
+        matched, to_update, batches = counts.matched, counts.to_update, 1
+        if not dry_run and to_update:
+            ids = _apply_reprice(db, conditions, new_price)
+            updated = len(ids)
+    else:
+        after_id = 0
+        while True:
+            counts = db.execute(reprice_count_statement(conditions, new_price, after_id, batch_size)).one()
+            if counts.last_id is None:
+                break
+            matched += counts.matched
+            to_update += counts.to_update
+            batches += 1
+            if not dry_run and counts.to_update:
+                bounds = [Purchase.purchase_id > after_id, Purchase.purchase_id <= counts.last_id]
+                batch_ids = _apply_reprice(db, conditions + bounds, new_price)
+                _commit_reprice(db, batch_ids, invalidate)
+                updated += len(batch_ids)
+            after_id = counts.last_id
+
+    if dry_run:
+        db.rollback()
+    else:
+        _commit_reprice(db, ids, invalidate)
+    return {
+        "matched": matched,
+        "to_update": to_update,
+        "updated": updated,
+        "batches": batches,
+        "dry_run": dry_run,
+    }
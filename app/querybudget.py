@@ -0,0 +1,119 @@
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+from sqlalchemy import event
+from session import env_int, engine, async_engine
+
+# Query budget and N+1 detection for debugging and tests.
+# Every API request and CLI command gets a QueryTracker that counts the
+# statements it executes. Statements are normalized (literals and IN lists
+# collapsed) so the same query with different parameters, the typical lazy
+# load per row, is recognised as a repeat. Going over the budget or
+# repeating a statement NPLUSONE_THRESHOLD times is logged in warn mode and
+# raises QueryBudgetExceeded in raise mode. Off by default.
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off").lower()
+if QUERY_BUDGET_MODE not in ("off", "warn", "raise"):
+    raise ValueError("QUERY_BUDGET_MODE must be 'off', 'warn' or 'raise'.")
+# Statements allowed per request or command without a budget of its own
+QUERY_BUDGET_DEFAULT = env_int("QUERY_BUDGET_DEFAULT", 20)
+# Executions of one normalized statement that count as an N+1 pattern
+NPLUSONE_THRESHOLD = env_int("NPLUSONE_THRESHOLD", 5)
+
+budget_log = logging.getLogger("sales.query_budget")
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+# Endpoints and commands set their own budget with this decorator; it only
+# tags the function, so it can sit under the route decorator. None turns the
+# checks off for batch jobs that repeat a statement by design
+def query_budget(limit: Optional[int]) -> Callable:
+    def tag(func: Callable) -> Callable:
+        func.query_budget = limit
+        return func
+    return tag
+
+def budget_of(func: Optional[Callable]) -> Optional[int]:
+    return getattr(func, "query_budget", QUERY_BUDGET_DEFAULT)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r"\bIN \((?:[^()]*)\)", re.IGNORECASE)
+
+def normalize_statement(statement: str) -> str:
+    statement = " ".join(statement.split())
+    statement = IN_LISTS.sub("IN (?)", statement)
+    return LITERALS.sub("?", statement)
+
+class QueryTracker:
+    def __init__(self, label: str, budget: Optional[int] = QUERY_BUDGET_DEFAULT, scope: Optional[dict] = None):
+        self.label = label
+        self._budget = budget
+        # For requests the endpoint, and with it the budget, is only known
+        # once routing has run
+        self._scope = scope
+        self.count = 0
+        self.statements = Counter()
+
+    @property
+    def budget(self) -> Optional[int]:
+        if self._scope is not None:
+            return budget_of(self._scope.get("endpoint"))
+        return self._budget
+
+    def repeated(self, threshold: int = NPLUSONE_THRESHOLD):
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def record(self, statement: str):
+        self.count += 1
+        key = normalize_statement(statement)
+        self.statements[key] += 1
+
+        budget = self.budget
+        if budget is None:
+            return
+        if self.count == budget + 1:
+            self.report(f"{self.label}: more than {budget} queries")
+        if self.statements[key] == NPLUSONE_THRESHOLD:
+            self.report(f"{self.label}: possible N+1, executed {NPLUSONE_THRESHOLD} times: {key[:300]}")
+
+    def report(self, message: str):
+        if QUERY_BUDGET_MODE == "raise":
+            raise QueryBudgetExceeded(message)
+        budget_log.warning(message)
+
+current_tracker: ContextVar[Optional[QueryTracker]] = ContextVar("current_tracker", default=None)
+
+@contextmanager
+def track_queries(label: str, budget: Optional[int] = QUERY_BUDGET_DEFAULT, scope: Optional[dict] = None) -> Iterator[QueryTracker]:
+    tracker = QueryTracker(label, budget, scope)
+    token = current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        current_tracker.reset(token)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracker = current_tracker.get()
+    if tracker is not None:
+        tracker.record(statement)
+
+if QUERY_BUDGET_MODE != "off":
+    for sync_engine in (engine, async_engine.sync_engine):
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or QUERY_BUDGET_MODE == "off":
+            await self.app(scope, receive, send)
+            return
+        with track_queries(f"{scope['method']} {scope['path']}", scope=scope):
+            await self.app(scope, receive, send)
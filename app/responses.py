@@ -0,0 +1,30 @@
+from decimal import Decimal
+from typing import Any, Dict, List
+import orjson
+from sqlalchemy.engine import Result
+from starlette.responses import Response
+
+# Fast path for large JSON responses.
+# Endpoints returning many rows select plain columns instead of ORM objects
+# and hand the rows to OrjsonResponse, which skips response_model
+# validation and encodes with orjson. The response_model stays on the route
+# for the OpenAPI schema and the payload has the same fields.
+
+class OrjsonResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+# NUMERIC results, e.g. sum() of an integer column on PostgreSQL
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def response_columns(model, response_model) -> List[Any]:
+    # Columns in the order of the response model fields
+    return [getattr(model, name) for name in response_model.model_fields]
+
+def rows_as_dicts(result: Result) -> List[Dict[str, Any]]:
+    return [row._asdict() for row in result]
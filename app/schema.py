@@ -0,0 +1,179 @@
+from typing import Callable, List, Tuple
+from sqlalchemy import DDL, bindparam, select, text
+from sqlalchemy.engine import Connection, Engine
+from session import env_int
+from models import (
+    Base, Product, Customer, SchemaMigration, SALES_SUMMARY_TRIGGERS,
+    CHANGE_FEED_TABLES, CHANGE_FEED_FUNCTIONS, change_feed_columns_ddl, change_feed_triggers_ddl,
+)
+from partitions import ensure_purchase_partitions
+
+# Schema setup, run once when the app or the CLI starts.
+# create_all only adds missing tables. Functions, triggers and other DDL
+# that create_all can't express are one-time migrations: each is applied
+# once and recorded in schema_migrations, so later starts only read that
+# table and take no locks on the data tables. Starting processes queue on a
+# PostgreSQL advisory lock, so only the first one applies a migration.
+
+# Any fixed key, shared by every process using this database
+SCHEMA_LOCK_KEY = 7_240_001
+
+# Rows numbered per transaction when existing rows get their change_seq
+CHANGE_FEED_BACKFILL_BATCH_SIZE = env_int("CHANGE_FEED_BACKFILL_BATCH_SIZE", 10000)
+
+def install_sales_summary_triggers(conn: Connection):
+    for statement in SALES_SUMMARY_TRIGGERS:
+        conn.execute(DDL(statement))
+    conn.commit()
+
+def backfill_change_seq(conn: Connection, table: str, pk: str, batch_size: int = CHANGE_FEED_BACKFILL_BATCH_SIZE) -> int:
+    # Keyset batches over the primary key, one short transaction each, so
+    # writers are never blocked for long. Runs before the row trigger is
+    # installed, rows keep the change_xid 0 of the ADD COLUMN
+    numbered, after_id = 0, 0
+    while True:
+        last_id = conn.scalar(
+            text(f"SELECT max({pk}) FROM (SELECT {pk} FROM {table} WHERE {pk} > :after_id ORDER BY {pk} LIMIT :limit) AS batch"),
+            {"after_id": after_id, "limit": batch_size},
+        )
+        if last_id is None:
+            return numbered
+        numbered += conn.execute(
+            text(
+                f"UPDATE {table} SET change_seq = nextval('change_seq') "
+                f"WHERE {pk} > :after_id AND {pk} <= :last_id AND change_seq IS NULL"
+            ),
+            {"after_id": after_id, "last_id": last_id},
+        ).rowcount
+        conn.commit()
+        after_id = last_id
+
+def install_change_feed(conn: Connection):
+    for statement in CHANGE_FEED_FUNCTIONS:
+        conn.execute(DDL(statement))
+    conn.commit()
+    for table, entity, pk in CHANGE_FEED_TABLES:
+        # Committed per table, so the ACCESS EXCLUSIVE lock of the ALTERs
+        # is held only for the catalog changes
+        for statement in change_feed_columns_ddl(table):
+            conn.execute(DDL(statement))
+        conn.commit()
+        backfill_change_seq(conn, table, pk)
+        for statement in change_feed_triggers_ddl(table, entity, pk):
+            conn.execute(DDL(statement))
+        conn.commit()
+
+# Purchases are deleted with their product or customer, see the
+# passive_deletes relationships in models.py. Tables created before that
+# get their foreign keys swapped for ON DELETE CASCADE ones
+PURCHASE_FOREIGN_KEYS = [("product_id", "products"), ("customer_id", "customers")]
+
+def cascade_purchase_foreign_keys(conn: Connection):
+    # Constraints declared on purchases itself, not the copies on partitions
+    existing = {
+        column: (name, action)
+        for name, column, action in conn.execute(text(
+            "SELECT c.conname, a.attname, c.confdeltype FROM pg_constraint c "
+            "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+            "WHERE c.conrelid = 'purchases'::regclass AND c.contype = 'f' AND c.conparentid = 0"
+        ))
+    }
+    partitioned = conn.scalar(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'purchases'::regclass")) is not None
+    for column, parent in PURCHASE_FOREIGN_KEYS:
+        name, action = existing.get(column, (f"purchases_{column}_fkey", None))
+        if action == "c":
+            continue
+        drop = f"DROP CONSTRAINT {name}, " if action is not None else ""
+        # NOT VALID keeps the swap to a catalog change, the rows are checked
+        # afterwards without blocking writers. Partitioned tables don't
+        # support it and check them right away
+        conn.execute(text(
+            f"ALTER TABLE purchases {drop}ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+            f"REFERENCES {parent} ({column}) ON DELETE CASCADE{'' if partitioned else ' NOT VALID'}"
+        ))
+        conn.commit()
+        if not partitioned:
+            conn.execute(text(f"ALTER TABLE purchases VALIDATE CONSTRAINT {name}"))
+            conn.commit()
+
+# CREATE/DROP INDEX CONCURRENTLY can't run in a transaction block
+def run_concurrently(conn: Connection, statements: List[str]):
+    conn.commit()
+    conn.execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+    finally:
+        conn.commit()
+        conn.execution_options(isolation_level=conn.default_isolation_level)
+
+# Composite (sort key, id) indexes of the keyset pages of /products/filter/
+# and /customers/sorted/, which replace the narrower indexes below. Built
+# CONCURRENTLY so existing tables stay writable; a build that failed half
+# way leaves an invalid index behind, which is dropped and built again
+KEYSET_PAGE_INDEXES = [
+    "ix_products_manufacturer_unit_product_id",
+    "ix_products_manufacturer_unit_name",
+    "ix_customers_name_customer_id",
+    "ix_customers_address_customer_id",
+    "ix_customers_phone_customer_id",
+]
+REPLACED_INDEXES = ["ix_products_manufacturer_unit", "ix_customers_name"]
+
+def create_keyset_page_indexes(conn: Connection):
+    indexes = {index.name: index for model in (Product, Customer) for index in model.__table__.indexes}
+    invalid = set(conn.scalars(
+        text("SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid AND c.relname IN :names")
+        .bindparams(bindparam("names", expanding=True)),
+        {"names": KEYSET_PAGE_INDEXES},
+    ))
+    statements = [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in KEYSET_PAGE_INDEXES if name in invalid]
+    for name in KEYSET_PAGE_INDEXES:
+        index = indexes[name]
+        columns = ", ".join(column.name for column in index.columns)
+        statements.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {index.table.name} ({columns})")
+    statements += [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in REPLACED_INDEXES]
+    run_concurrently(conn, statements)
+
+# Applied in this order; never rename or reorder applied migrations, append
+# new ones
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("sales_summary_triggers", install_sales_summary_triggers),
+    ("change_feed", install_change_feed),
+    ("purchase_foreign_keys_cascade", cascade_purchase_foreign_keys),
+    ("keyset_page_indexes", create_keyset_page_indexes),
+]
+
+def apply_migrations(conn: Connection) -> List[str]:
+    applied = set(conn.scalars(select(SchemaMigration.name)))
+    conn.commit()
+    names = []
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        # A migration may commit on its own, e.g. between batches, so it is
+        # only recorded once it has run to the end
+        migrate(conn)
+        conn.execute(SchemaMigration.__table__.insert().values(name=name))
+        conn.commit()
+        names.append(name)
+    return names
+
+def setup_database(engine: Engine) -> List[str]:
+    with engine.connect() as conn:
+        postgres = engine.dialect.name == "postgresql"
+        if postgres:
+            conn.exec_driver_sql(f"SELECT pg_advisory_lock({SCHEMA_LOCK_KEY})")
+        try:
+            Base.metadata.create_all(conn)
+            conn.commit()
+            # The migrations are PostgreSQL functions and triggers
+            applied = apply_migrations(conn) if postgres else []
+        finally:
+            if postgres:
+                conn.rollback()
+                conn.exec_driver_sql(f"SELECT pg_advisory_unlock({SCHEMA_LOCK_KEY})")
+                conn.commit()
+    # Monthly purchase partitions around the current date, if enabled
+    ensure_purchase_partitions(engine)
+    return applied
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+from fastapi import Depends
+from typing import Any, AsyncGenerator, Dict, Generator
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+# Database URL configuration, DATABASE_URL takes precedence over the parts
+if os.getenv("DATABASE_URL"):
+    url = make_url(os.environ["DATABASE_URL"])
+else:
+    url = URL.create(
+        drivername="postgresql+psycopg2",
+        username=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "1453"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=env_int("DB_PORT", 5432),
+        database=os.getenv("DB_NAME", "sales_office")
+    )
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+async_url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+# Pool settings
+POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+POOL_TIMEOUT = env_float("DB_POOL_TIMEOUT", 30)
+POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", False)
+POOL_RECYCLE = env_int("DB_POOL_RECYCLE", -1)
+# Compiled SQL kept per engine, keyed by statement structure, see
+# compiled_cache_stats in metrics.py
+QUERY_CACHE_SIZE = env_int("DB_QUERY_CACHE_SIZE", 500)
+# 0 leaves the server default in place
+STATEMENT_TIMEOUT_MS = env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+# Behind PgBouncer in transaction mode connections are not kept in a local
+# pool and asyncpg must not rely on server-side prepared statements
+PGBOUNCER = env_bool("DB_PGBOUNCER", False)
+
+
+# Pool checkout statistics: how long callers waited for a connection and
+# how many connections are checked out right now
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.in_use = 0
+        # Called with every wait, used by the metrics module
+        self.listeners = []
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        for listener in self.listeners:
+            listener(seconds)
+
+    def checked_out(self):
+        with self._lock:
+            self.in_use += 1
+
+    def checked_in(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_use": self.in_use,
+                "checkout_waits": self.waits,
+                "checkout_wait_seconds_total": self.wait_seconds_total,
+                "checkout_wait_seconds_max": self.wait_seconds_max,
+            }
+
+sync_pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+class _TimedCheckout:
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    stats = sync_pool_stats
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    stats = async_pool_stats
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    stats = sync_pool_stats
+
+class TimedAsyncNullPool(_TimedCheckout, NullPool):
+    stats = async_pool_stats
+
+
+def engine_options(queue_pool, null_pool, is_async: bool) -> Dict[str, Any]:
+    if PGBOUNCER:
+        options = {"poolclass": null_pool}
+    else:
+        options = {
+            "poolclass": queue_pool,
+            "pool_size": POOL_SIZE,
+            "max_overflow": MAX_OVERFLOW,
+            "pool_timeout": POOL_TIMEOUT,
+            "pool_recycle": POOL_RECYCLE,
+        }
+    options["pool_pre_ping"] = POOL_PRE_PING
+    options["query_cache_size"] = QUERY_CACHE_SIZE
+
+    if url.get_backend_name() == "postgresql":
+        connect_args = {}
+        if is_async:
+            if STATEMENT_TIMEOUT_MS:
+                connect_args["server_settings"] = {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}
+            if PGBOUNCER:
+                connect_args["statement_cache_size"] = 0
+        elif STATEMENT_TIMEOUT_MS:
+            connect_args["options"] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+        options["connect_args"] = connect_args
+    return options
+
+def track_checkouts(sync_engine, stats: PoolStats):
+    event.listen(sync_engine, "checkout", lambda *args: stats.checked_out())
+    event.listen(sync_engine, "checkin", lambda *args: stats.checked_in())
+
+if PGBOUNCER and url.get_backend_name() == "postgresql":
+    # The asyncpg dialect keeps its own prepared statement cache as well
+    async_url = async_url.update_query_dict({"prepared_statement_cache_size": "0"})
+
+# Create SQLAlchemy engine
+engine = create_engine(url, **engine_options(TimedQueuePool, TimedNullPool, is_async=False))
+track_checkouts(engine, sync_pool_stats)
+
+# Create a session factory
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine for the API, same database through asyncpg
+async_engine = create_async_engine(async_url, **engine_options(TimedAsyncQueuePool, TimedAsyncNullPool, is_async=True))
+track_checkouts(async_engine.sync_engine, async_pool_stats)
+
+# Objects stay usable after commit, lazy reloads are not possible with asyncio
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+def pool_status() -> Dict[str, Any]:
+    status = {}
+    for name, db_engine, stats in (("sync", engine, sync_pool_stats), ("async", async_engine.sync_engine, async_pool_stats)):
+        pool = db_engine.pool
+        status[name] = {"pool": type(pool).__name__, **stats.as_dict()}
+        if isinstance(pool, QueuePool):
+            status[name].update(size=pool.size(), overflow=pool.overflow(), checked_in=pool.checkedin())
+    return status
+
+# Dependency for getting the session
+def get_db() -> Generator[Session, None, None]:
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency for getting an async session
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
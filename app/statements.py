@@ -0,0 +1,45 @@
+from typing import Any, Dict, Optional
+from sqlalchemy import bindparam, delete, insert, select
+from sqlalchemy.orm import Session
+from models import Product, Customer, Purchase
+
+# Hot single-row statements of the API and the CLI: lookup, create and
+# delete by id. They are built once here and executed with bound
+# parameters, so each call skips building the expression, and its cache
+# key is memoized on the statement object, so the compiled SQL comes
+# straight out of the engine's compiled cache (see compiled_cache_stats in
+# metrics.py for the hit rate). asyncpg also keeps them as prepared
+# statements per connection. They are Core statements on the tables:
+# rows come back as the plain dicts the entity cache stores, without ORM
+# objects, and creates return the new row through INSERT ... RETURNING
+# instead of a second SELECT.
+
+def entity_columns(model):
+    return [attr.columns[0] for attr in model.__mapper__.column_attrs]
+
+# Purchases are identified by purchase_id alone, see Purchase.__mapper_args__
+def entity_pk(model):
+    return model.__mapper__.primary_key[0]
+
+LOOKUP_STATEMENTS = {
+    model: select(*entity_columns(model)).where(entity_pk(model) == bindparam("entity_id"))
+    for model in (Product, Customer, Purchase)
+}
+INSERT_STATEMENTS = {
+    model: insert(model.__table__).returning(*entity_columns(model))
+    for model in (Product, Customer, Purchase)
+}
+DELETE_STATEMENTS = {
+    model: delete(model.__table__).where(entity_pk(model) == bindparam("entity_id"))
+    for model in (Product, Customer, Purchase)
+}
+
+def lookup_row(db: Session, model, entity_id: int) -> Optional[Dict[str, Any]]:
+    row = db.execute(LOOKUP_STATEMENTS[model], {"entity_id": entity_id}).mappings().first()
+    return dict(row) if row is not None else None
+
+def insert_row(db: Session, model, values: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(db.execute(INSERT_STATEMENTS[model], values).mappings().one())
+
+def delete_row(db: Session, model, entity_id: int) -> int:
+    return db.execute(DELETE_STATEMENTS[model], {"entity_id": entity_id}).rowcount
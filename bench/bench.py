@@ -0,0 +1,588 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import numpy as np
+
+# Benchmark and load test for the API and the CLI.
+#
+#   python bench/bench.py run --database-url postgresql+psycopg2://... --scales small,medium --output current.json
+#   python bench/bench.py compare baseline.json current.json
+#
+# Every scale starts from an empty schema seeded by the generator.py generators
+# with a fixed seed. Then each API endpoint is driven through the ASGI app
+# in-process (no network) and each CLI command in method_dict through its
+# handler, both with a fixed concurrency. Results are latency percentiles,
+# throughput and memory per scenario as JSON. Writing scenarios run after
+# the read-only ones; delete-all runs last but for the imports, which reload
+# the tables exported by the read phase. The database is dropped and
+# recreated, never point this at one holding data you want to keep.
+#
+# Every scenario shares one process, so ru_maxrss is the high-water mark of
+# the whole run up to that scenario: cumulative_peak_rss_mb never goes down,
+# and peak_rss_growth_mb is how much a scenario raised it.
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+SCALES = {
+    "tiny": {"product": 50, "customer": 50, "purchase": 2_000},
+    "small": {"product": 500, "customer": 500, "purchase": 50_000},
+    "medium": {"product": 5_000, "customer": 5_000, "purchase": 500_000},
+    "large": {"product": 20_000, "customer": 20_000, "purchase": 5_000_000},
+}
+
+# Scenarios that read or rewrite whole tables run this many times fewer
+HEAVY_DIVISOR = 20
+# Change events read per stream request, one batch; every scale seeds more
+# rows than this of each entity, so a stream never waits for new changes
+STREAM_EVENTS = 50
+# Seconds a stream request may take before it counts as failed
+STREAM_TIMEOUT = 30.0
+# All seeded purchases are dated relative to this day, keeping runs comparable
+SEED_DAY = datetime(2025, 1, 1)
+
+MANUFACTURERS = ["TechPro Manufacturing", "GlobalTech Industries", "Innovative Solutions", "Quality Producers"]
+
+
+# Runner helpers
+
+@contextmanager
+def stdout_to_stderr():
+    # Seeding workers are separate processes printing progress, move file
+    # descriptor 1 so the JSON on stdout stays clean
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def summarize(latencies: List[float], errors: int, elapsed: float, rss_before: float) -> Dict[str, Any]:
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "cumulative_peak_rss_mb": peak_rss_mb(),
+        "cumulative_peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "peak_rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+def load_plan(requests: int, concurrency: int, heavy: bool, once: bool) -> Tuple[int, int]:
+    if once:
+        return 1, 1
+    if heavy:
+        return max(1, requests // HEAVY_DIVISOR), min(concurrency, 2)
+    return requests, concurrency
+
+async def drive_async(call: Callable, requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies, errors = [], 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            started = time.perf_counter()
+            try:
+                ok = await call(index)
+            except Exception as err:
+                print(f"  error: {err!r}", file=sys.stderr)
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started, rss_before)
+
+def drive_threads(call: Callable, requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    indexes = iter(range(requests))
+
+    def next_index():
+        with lock:
+            return next(indexes, None)
+
+    def worker():
+        while (index := next_index()) is not None:
+            started = time.perf_counter()
+            try:
+                ok = call(index)
+            except Exception as err:
+                print(f"  error: {err!r}", file=sys.stderr)
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += not ok
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - started, rss_before)
+
+
+# Seeding
+
+def seed_database(counts: Dict[str, int], seed: int, workers: int):
+    from cache import entity_cache
+    from generator import generate_parallel
+    from models import Base
+    from schema import setup_database
+    from session import engine
+    from sqlalchemy import text
+
+    Base.metadata.drop_all(engine)
+    setup_database(engine)
+    entity_cache.clear()
+
+    for offset, entity in enumerate(("product", "customer", "purchase")):
+        started = time.perf_counter()
+        generate_parallel(entity, counts[entity], workers=workers, seed=seed + offset, now=SEED_DAY)
+        print(f"seeded {counts[entity]} {entity}s in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM ANALYZE"))
+
+def load_olap_snapshot():
+    from olap import olap_snapshot
+    from session import SessionLocal
+
+    # The ASGI transport doesn't run the lifespan, whose task keeps the
+    # snapshot fresh; the top-N scenarios read the one loaded here
+    with SessionLocal() as db:
+        olap_snapshot.refresh(db)
+
+
+# API scenarios: name -> request factory, heavy, postgres only.
+# A factory takes the request index and returns (method, url, httpx kwargs);
+# an "events" kwarg reads that many server-sent events and disconnects
+
+def api_scenarios(counts: Dict[str, int], rng: random.Random) -> List[Tuple[str, Callable, bool, bool]]:
+    product = lambda: rng.randint(1, counts["product"])
+    customer = lambda: rng.randint(1, counts["customer"])
+    purchase = lambda: rng.randint(1, counts["purchase"])
+    dimension = lambda: rng.choice(["product", "customer", "manufacturer", "unit"])
+    change_entity = lambda: rng.choice(["products", "customers", "purchases"])
+    product_body = lambda i: {"name": f"Bench {i}", "manufacturer": rng.choice(MANUFACTURERS), "unit": "kg"}
+    customer_body = lambda i: {"name": f"Bench {i}", "address": "1 Main St", "phone": "+70000000000", "contact_person": "Bench"}
+    purchase_body = lambda i: {
+        "product_id": product(), "customer_id": customer(), "quantity": rng.randint(1, 100),
+        "delivery_date": "2025-01-15T10:00:00", "price_per_unit": 9.5,
+    }
+
+    reads = [
+        ("GET /products/{id}", lambda i: ("GET", f"/api/products/{product()}", {}), False, False),
+        ("GET /products/", lambda i: ("GET", "/api/products/", {"params": {"limit": 100, "after_id": product()}}), False, False),
+        ("GET /products/filter/", lambda i: ("GET", "/api/products/filter/", {"params": {"manufacturer": rng.choice(MANUFACTURERS), "unit": "kg"}}), False, False),
+        ("GET /customers/{id}", lambda i: ("GET", f"/api/customers/{customer()}", {}), False, False),
+        ("GET /customers/", lambda i: ("GET", "/api/customers/", {"params": {"limit": 100, "after_id": customer()}}), False, False),
+        ("GET /customers/sorted/", lambda i: ("GET", "/api/customers/sorted/", {"params": {"sort_by": "name"}}), True, False),
+        ("GET /purchases/{id}", lambda i: ("GET", f"/api/purchases/{purchase()}", {}), False, False),
+        ("GET /purchases/", lambda i: ("GET", "/api/purchases/", {"params": {"limit": 100, "after_id": purchase()}}), False, False),
+        ("GET /purchases/details/", lambda i: ("GET", "/api/purchases/details/", {"params": {"format": "ndjson"}}), True, False),
+        ("GET /purchases/group-by-product/", lambda i: ("GET", "/api/purchases/group-by-product/", {}), False, False),
+        ("GET /purchases/group-by-product/daily/", lambda i: ("GET", "/api/purchases/group-by-product/daily/", {"params": {"product_id": product()}}), False, False),
+        ("POST /purchases/reprice dry-run", lambda i: ("POST", "/api/purchases/reprice", {"json": {"new_price": 9.99, "product_id": product(), "dry_run": True}}), False, False),
+        ("GET /analytics/customer-purchases/{id}", lambda i: ("GET", f"/api/analytics/customer-purchases/{customer()}", {}), False, False),
+        ("GET /analytics/customer-purchases/{id} olap", lambda i: ("GET", f"/api/analytics/customer-purchases/{customer()}", {"params": {"source": "olap"}}), False, False),
+        ("GET /analytics/product-sales/{id}", lambda i: ("GET", f"/api/analytics/product-sales/{product()}", {}), False, False),
+        ("GET /analytics/product-sales/{id} live", lambda i: ("GET", f"/api/analytics/product-sales/{product()}", {"params": {"source": "live"}}), False, False),
+        ("GET /analytics/product-sales/{id} olap", lambda i: ("GET", f"/api/analytics/product-sales/{product()}", {"params": {"source": "olap"}}), False, False),
+        ("GET /analytics/top/{dimension}", lambda i: ("GET", f"/api/analytics/top/{dimension()}", {}), False, False),
+        ("GET /analytics/top/{dimension} filtered", lambda i: ("GET", f"/api/analytics/top/{dimension()}", {"params": {"manufacturer": rng.choice(MANUFACTURERS), "date_from": "2024-07-01"}}), False, False),
+        ("GET /changes/{entity}", lambda i: ("GET", f"/api/changes/{change_entity()}", {"params": {"limit": 1000}}), False, True),
+        ("GET /changes/{entity}/stream", lambda i: ("GET", f"/api/changes/{change_entity()}/stream", {"params": {"limit": STREAM_EVENTS}, "events": STREAM_EVENTS}), False, True),
+        ("GET /debug/explain/", lambda i: ("GET", "/api/debug/explain/", {"params": {"name": "get-purchase"}}), True, True),
+        ("GET /pool/stats", lambda i: ("GET", "/pool/stats", {}), False, False),
+        ("GET /cache/stats", lambda i: ("GET", "/cache/stats", {}), False, False),
+        ("GET /cache/compiled", lambda i: ("GET", "/cache/compiled", {}), False, False),
+        ("GET /olap/stats", lambda i: ("GET", "/olap/stats", {}), False, False),
+        ("GET /metrics", lambda i: ("GET", "/metrics", {}), False, False),
+    ]
+    writes = [
+        ("POST /products/", lambda i: ("POST", "/api/products/", {"json": product_body(i)}), False, False),
+        ("POST /customers/", lambda i: ("POST", "/api/customers/", {"json": customer_body(i)}), False, False),
+        ("POST /purchases/", lambda i: ("POST", "/api/purchases/", {"json": purchase_body(i)}), False, False),
+        ("POST /products/bulk", lambda i: ("POST", "/api/products/bulk", {"json": [product_body(i)] * 100}), False, False),
+        ("POST /customers/bulk", lambda i: ("POST", "/api/customers/bulk", {"json": [customer_body(i)] * 100}), False, False),
+        ("POST /purchases/bulk", lambda i: ("POST", "/api/purchases/bulk", {"json": [purchase_body(i) for _ in range(100)]}), False, False),
+        ("PUT /purchases/update-price/{id}", lambda i: ("PUT", f"/api/purchases/update-price/{purchase()}", {"params": {"new_price": 11.5}}), False, False),
+        ("POST /purchases/reprice", lambda i: ("POST", "/api/purchases/reprice", {"json": {"new_price": 12.5, "product_id": product()}}), False, False),
+    ]
+    return reads + writes
+
+
+async def read_event_stream(app, url: str, params: Dict[str, Any], events: int) -> int:
+    # httpx.ASGITransport returns only once the app has sent the whole body,
+    # which an event stream never does, so the stream is read through the
+    # ASGI interface directly: a disconnect is sent once enough events came
+    status, received = 0, 0
+    done = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, received
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            if status >= 400:
+                done.set()
+        elif message["type"] == "http.response.body":
+            received += message.get("body", b"").count(b"\nevent: ")
+            if received >= events:
+                done.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": url, "raw_path": url.encode(), "root_path": "",
+        "query_string": urlencode(params).encode(), "headers": [(b"host", b"bench")],
+        "server": ("bench", 80), "client": ("127.0.0.1", 0),
+    }
+    await asyncio.wait_for(app(scope, receive, send), STREAM_TIMEOUT)
+    return status if received >= events or status >= 400 else 0
+
+async def run_api(counts: Dict[str, int], rng: random.Random, requests: int, concurrency: int, dialect: str) -> List[Dict[str, Any]]:
+    import httpx
+    from main import app
+    from session import async_engine
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, factory, heavy, postgres_only in api_scenarios(counts, rng):
+            if postgres_only and dialect != "postgresql":
+                continue
+
+            async def call(index: int, factory=factory) -> bool:
+                method, url, kwargs = factory(index)
+                if "events" in kwargs:
+                    status = await read_event_stream(app, url, kwargs["params"], kwargs["events"])
+                else:
+                    status = (await client.request(method, url, **kwargs)).status_code
+                # 404 is a valid answer for a random id of a deleted row
+                return 0 < status < 400 or status == 404
+
+            total, workers = load_plan(requests, concurrency, heavy, once=False)
+            result = await drive_async(call, total, workers)
+            results.append({"kind": "api", "name": name, "concurrency": workers, **result})
+            print(f"  api {name}: p95 {result['p95_ms']} ms, {result['throughput_rps']} req/s", file=sys.stderr)
+    await async_engine.dispose()
+    return results
+
+
+# CLI scenarios: name -> command factory, heavy, postgres only, run once.
+# query 3 is purchase reprice under another name
+
+def cli_scenarios(
+    counts: Dict[str, int], rng: random.Random, top_ids: Dict[str, int], export_dir: str
+) -> List[Tuple[str, Callable, bool, bool, bool]]:
+    product = lambda: rng.randint(1, counts["product"])
+    customer = lambda: rng.randint(1, counts["customer"])
+    purchase = lambda: rng.randint(1, counts["purchase"])
+    # Deletes walk down from the highest id, i.e. rows created by the bench
+    newest = lambda entity, i: top_ids[entity] - i
+    dimension = lambda: rng.choice(["product", "customer", "manufacturer", "unit"])
+    # One file per run, concurrent exports must not write the same one; the
+    # imports load the first
+    exported = lambda dataset, i, extension="parquet": os.path.join(export_dir, f"{dataset}-{i}.{extension}")
+
+    reads = [
+        ("product get", lambda i: f"product get {product()}", False, False, False),
+        ("product get-all", lambda i: "product get-all", True, False, False),
+        ("customer get", lambda i: f"customer get {customer()}", False, False, False),
+        ("customer get-all", lambda i: "customer get-all", True, False, False),
+        ("purchase get", lambda i: f"purchase get {purchase()}", False, False, False),
+        ("purchase get-all", lambda i: "purchase get-all", True, False, False),
+        ("purchase details ndjson", lambda i: "purchase details ndjson", True, False, False),
+        ("purchase reprice dry-run", lambda i: f"purchase reprice 9.99 --product-id {product()} --dry-run yes", False, False, False),
+        ("query 1", lambda i: f"query 1 {rng.choice(MANUFACTURERS)} --unit kg", True, False, False),
+        ("query 2", lambda i: f"query 2 {customer()}", False, False, False),
+        ("query 2 olap", lambda i: f"query 2 {customer()} --source olap", False, False, False),
+        ("query 4", lambda i: f"query 4 {product()}", False, False, False),
+        ("query 4 live", lambda i: f"query 4 {product()} --source live", False, False, False),
+        ("query 4 all", lambda i: "query 4", True, False, False),
+        ("query 5", lambda i: f"query 5 {dimension()}", False, False, False),
+        ("query 5 filtered", lambda i: f"query 5 {dimension()} --unit kg --date-from 2024-07-01", False, False, False),
+        ("export products", lambda i: f"export products {exported('products', i)}", True, False, False),
+        ("export customers", lambda i: f"export customers {exported('customers', i)}", True, False, False),
+        ("export purchases", lambda i: f"export purchases {exported('purchases', i)}", True, False, False),
+        ("export details arrow", lambda i: f"export details {exported('details', i, 'arrow')}", True, False, False),
+        ("explain query", lambda i: "explain query get-purchase", False, True, False),
+        ("explain all", lambda i: "explain all", True, True, True),
+    ]
+    writes = [
+        ("product create", lambda i: f"product create Bench{i} Bench kg", False, False, False),
+        ("customer create", lambda i: f"customer create Bench{i} Main +70000000000 Bench", False, False, False),
+        ("purchase create", lambda i: f"purchase create {product()} {customer()} 5 2025-01-15_10:00:00 9.5", False, False, False),
+        ("purchase reprice", lambda i: f"purchase reprice 12.5 --product-id {product()}", False, False, False),
+        ("purchase purge-before", lambda i: "purchase purge-before 2000-01-01", False, False, True),
+        ("product generate", lambda i: "product generate 10000 --workers 2 --seed 7", False, False, True),
+        ("purchase delete", lambda i: f"purchase delete {newest('purchase', i)}", False, False, False),
+        ("customer delete", lambda i: f"customer delete {newest('customer', i)}", False, False, False),
+        ("product delete", lambda i: f"product delete {newest('product', i)}", False, False, False),
+        ("purchase delete-all", lambda i: "purchase delete-all", False, False, True),
+        ("customer delete-all", lambda i: "customer delete-all", False, False, True),
+        ("product delete-all", lambda i: "product delete-all", False, False, True),
+        ("import products", lambda i: f"import products {exported('products', 0)}", False, False, True),
+        ("import customers", lambda i: f"import customers {exported('customers', 0)}", False, False, True),
+        ("import purchases", lambda i: f"import purchases {exported('purchases', 0)}", False, False, True),
+    ]
+    return reads + writes
+
+def run_cli_command(command: str) -> bool:
+    from data import parse_command
+    from session import SessionLocal
+
+    parsed = parse_command(command)
+    if not parsed["valid"]:
+        raise ValueError(f"Invalid command: {command}")
+    # Same as main.run_command, without printing
+    with SessionLocal() as db:
+        try:
+            result = parsed["method"](*parsed["args"], db)
+            if isinstance(result, str):
+                return not result.startswith("Error")
+            if result is not None:
+                for _ in result:
+                    pass
+            return True
+        except Exception:
+            db.rollback()
+            raise
+
+def current_top_ids() -> Dict[str, int]:
+    from models import Customer, Product, Purchase
+    from session import SessionLocal
+    from sqlalchemy import func, select
+
+    with SessionLocal() as db:
+        return {
+            entity: db.scalar(select(func.coalesce(func.max(pk), 0)))
+            for entity, pk in (("product", Product.product_id), ("customer", Customer.customer_id), ("purchase", Purchase.purchase_id))
+        }
+
+def run_cli(counts: Dict[str, int], rng: random.Random, requests: int, concurrency: int, dialect: str) -> List[Dict[str, Any]]:
+    results = []
+    top_ids = {}
+    export_dir = tempfile.mkdtemp(prefix="bench-export-")
+    try:
+        for name, factory, heavy, postgres_only, once in cli_scenarios(counts, rng, top_ids, export_dir):
+            if postgres_only and dialect != "postgresql":
+                continue
+            if name.endswith(" delete"):
+                top_ids.update(current_top_ids())
+
+            total, workers = load_plan(requests, concurrency, heavy, once)
+            result = drive_threads(lambda index, factory=factory: run_cli_command(factory(index)), total, workers)
+            results.append({"kind": "cli", "name": name, "concurrency": workers, **result})
+            print(f"  cli {name}: p95 {result['p95_ms']} ms, {result['throughput_rps']} cmd/s", file=sys.stderr)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    return results
+
+
+# Compare
+
+def failed_scenarios(current: Dict[str, Any], max_error_rate: float) -> List[Dict[str, Any]]:
+    # Latencies of a scenario that mostly fails measure the error path, not
+    # the feature, so such a run must not pass for a baseline
+    return [result for result in current["results"] if result["error_rate"] > max_error_rate]
+
+def result_key(result: Dict[str, Any]) -> Tuple[str, str, str]:
+    return result["scale"], result["kind"], result["name"]
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float, min_delta_ms: float) -> Dict[str, Any]:
+    # A scenario regresses when p95 grows or throughput drops by more than
+    # threshold; sub-millisecond p95 jitter below min_delta_ms is ignored
+    previous = {result_key(result): result for result in baseline["results"]}
+    rows, regressions = [], []
+    for result in current["results"]:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        p95_delta = result["p95_ms"] - before["p95_ms"]
+        p95_change = p95_delta / before["p95_ms"] if before["p95_ms"] else 0.0
+        throughput_change = (
+            result["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+        )
+        regressed = (p95_change > threshold and p95_delta > min_delta_ms) or throughput_change < -threshold
+        row = {
+            "scale": result["scale"],
+            "kind": result["kind"],
+            "name": result["name"],
+            "p95_ms": [before["p95_ms"], result["p95_ms"]],
+            "p95_change": round(p95_change, 3),
+            "throughput_rps": [before["throughput_rps"], result["throughput_rps"]],
+            "throughput_change": round(throughput_change, 3),
+            "peak_rss_growth_mb": [before.get("peak_rss_growth_mb"), result["peak_rss_growth_mb"]],
+            "regressed": regressed,
+        }
+        rows.append(row)
+        if regressed:
+            regressions.append(row)
+    return {"threshold": threshold, "min_delta_ms": min_delta_ms, "compared": rows, "regressions": regressions}
+
+def print_comparison(report: Dict[str, Any]):
+    for row in report["compared"]:
+        mark = "REGRESSION" if row["regressed"] else "ok"
+        print(
+            f"{mark:>10}  {row['scale']:<6} {row['kind']:<3} {row['name']:<40} "
+            f"p95 {row['p95_ms'][0]:>9.2f} -> {row['p95_ms'][1]:>9.2f} ms ({row['p95_change']:+.0%})  "
+            f"throughput {row['throughput_change']:+.0%}",
+            file=sys.stderr,
+        )
+    print(f"{len(report['regressions'])} regression(s) in {len(report['compared'])} scenarios", file=sys.stderr)
+
+def print_failures(failures: List[Dict[str, Any]]):
+    for result in failures:
+        print(
+            f"    FAILED  {result['scale']:<6} {result['kind']:<3} {result['name']:<40} "
+            f"{result['errors']} of {result['requests']} requests failed ({result['error_rate']:.0%})",
+            file=sys.stderr,
+        )
+
+
+# Entry points
+
+def run(args) -> Dict[str, Any]:
+    # The app reads its configuration at import time
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("EXPLAIN_ENDPOINT_ENABLED", "true")
+    os.environ.setdefault("OLAP_ENABLED", "true")
+    sys.path.insert(0, APP_DIR)
+    from session import engine
+
+    dialect = engine.dialect.name
+    results = []
+    with stdout_to_stderr():
+        for scale in args.scales.split(","):
+            counts = SCALES[scale]
+            print(f"scale {scale}: {counts}", file=sys.stderr)
+            if not args.skip_seed:
+                seed_database(counts, args.seed, args.workers)
+            rng = random.Random(args.seed)
+            scale_results = []
+            if args.only in (None, "api"):
+                load_olap_snapshot()
+                scale_results += asyncio.run(run_api(counts, rng, args.requests, args.concurrency, dialect))
+            if args.only in (None, "cli"):
+                scale_results += run_cli(counts, rng, args.requests, args.concurrency, dialect)
+            results += [{"scale": scale, **result} for result in scale_results]
+
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "dialect": dialect,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "scales": {scale: SCALES[scale] for scale in args.scales.split(",")},
+        },
+        "results": results,
+    }
+
+def write_json(data: Dict[str, Any], path: Optional[str]):
+    text = json.dumps(data, indent=2)
+    if path:
+        with open(path, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the sales office API and CLI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed, run the scenarios and write the results as JSON")
+    run_parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", "sqlite:///bench.db"))
+    run_parser.add_argument("--scales", default="tiny", help=f"comma separated, of {', '.join(SCALES)}")
+    run_parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--workers", type=int, default=2, help="processes seeding the data")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--only", choices=["api", "cli"])
+    run_parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in the database")
+    run_parser.add_argument("--output", help="file for the JSON results, stdout by default")
+    run_parser.add_argument("--baseline", help="compare the results with this earlier run")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+    run_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    run_parser.add_argument("--max-error-rate", type=float, default=0.0,
+                            help="exit 1 when a scenario fails more often than this")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files, exit 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    compare_parser.add_argument("--output", help="file for the JSON report, stdout by default")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        current = run(args)
+        write_json(current, args.output)
+        failures = failed_scenarios(current, args.max_error_rate)
+        print_failures(failures)
+        if failures:
+            return 1
+        if not args.baseline:
+            return 0
+    else:
+        with open(args.current) as file:
+            current = json.load(file)
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    report = compare_results(baseline, current, args.threshold, args.min_delta_ms)
+    print_comparison(report)
+    if args.command == "compare":
+        write_json(report, args.output)
+    return 1 if report["regressions"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())